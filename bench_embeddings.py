@@ -0,0 +1,124 @@
+"""
+Benchmark de almacenamiento de embeddings: memoria, latencia de búsqueda y
+recall@k de cada formato compacto contra float32 completo (fuerza bruta).
+
+Nota: los vectores sintéticos son isotrópicos (no concentran información en
+las primeras dims como text-embedding-3), así que el recall con dims truncadas
+sale pesimista; para decidir dims usar el store real (o su .npy full).
+
+Ejemplos:
+    python bench_embeddings.py                      # vectores de knowledge_store.json
+    python bench_embeddings.py --synthetic 20000    # catálogo sintético más grande
+    python bench_embeddings.py --synthetic 50000 --formats int8 --dims 0,512,256
+"""
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+from vector_index import VectorIndex, normalize, truncate
+
+PY_FLOAT_LIST_BYTES = 32  # float Python (24) + puntero en la lista (8)
+
+
+def load_vectors(path: str) -> np.ndarray:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    meta = data.get("embedding") or {}
+    if meta.get("full_precision_file"):
+        return np.load(os.path.join(os.path.dirname(os.path.abspath(path)), meta["full_precision_file"]))
+    vecs = [d["embedding"] for d in data.get("docs", []) if d.get("embedding")]
+    return np.asarray(vecs, dtype=np.float32)
+
+def synthetic_vectors(n: int, dims: int, clusters: int, seed: int) -> np.ndarray:
+    # Clusters temáticos + ruido: parecido a chunks de un catálogo real
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dims)).astype(np.float32)
+    assign = rng.integers(0, clusters, n)
+    return centers[assign] + 0.6 * rng.standard_normal((n, dims)).astype(np.float32)
+
+def make_queries(vectors: np.ndarray, n: int, noise: float, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed + 1)
+    idx = rng.integers(0, len(vectors), n)
+    base = normalize(vectors[idx])
+    return base + noise * rng.standard_normal(base.shape).astype(np.float32) / np.sqrt(base.shape[1])
+
+def exact_topk(full: np.ndarray, queries: np.ndarray, k: int):
+    scores = normalize(queries) @ full.T
+    return [set(np.argsort(-row)[:k].tolist()) for row in scores]
+
+def run_config(vectors, full, queries, truth, fmt, dims, k, rerank):
+    index = VectorIndex.from_vectors(vectors, fmt=fmt, dims=dims, full=full if rerank else None)
+    lat = []
+    hits = 0
+    for q, gold in zip(queries, truth):
+        t0 = time.perf_counter()
+        res = index.search(q, top_k=k, rerank_candidates=rerank)
+        lat.append(time.perf_counter() - t0)
+        hits += len(gold & {i for _, i in res})
+    lat.sort()
+    return {
+        "format": fmt,
+        "dims": index.dims,
+        "rerank": rerank,
+        "index_mb": round(index.nbytes() / 1e6, 2),
+        "p50_ms": round(lat[len(lat) // 2] * 1000, 3),
+        "p95_ms": round(lat[int(len(lat) * 0.95)] * 1000, 3),
+        "recall": round(hits / (k * len(queries)), 4),
+    }
+
+
+def main(args):
+    if args.synthetic:
+        vectors = synthetic_vectors(args.synthetic, args.source_dims, args.clusters, args.seed)
+    else:
+        vectors = load_vectors(args.store)
+    if not len(vectors):
+        raise SystemExit("sin vectores para medir")
+
+    full = truncate(vectors, 0)
+    queries = make_queries(vectors, args.queries, args.query_noise, args.seed)
+    k = min(args.k, len(vectors))
+    truth = exact_topk(full, queries, k)
+
+    n, d = full.shape
+    print(f"docs={n} dims={d} queries={len(queries)} k={k}")
+    print(f"referencia listas Python (STORE_EMBEDS antiguo): {n * d * PY_FLOAT_LIST_BYTES / 1e6:.2f} MB")
+    print(f"{'formato':<8} {'dims':>5} {'rerank':>6} {'MB':>9} {'p50 ms':>8} {'p95 ms':>8} {'recall@' + str(k):>9}")
+
+    rows = []
+    for fmt in args.formats.split(","):
+        for dims in [int(x) for x in args.dims.split(",")]:
+            for rerank in ([0, args.rerank] if args.rerank else [0]):
+                if fmt == "float32" and dims == 0 and rerank:
+                    continue  # ya es precisión completa
+                row = run_config(vectors, full, queries, truth, fmt, dims, k, rerank)
+                rows.append(row)
+                print(f"{row['format']:<8} {row['dims']:>5} {row['rerank']:>6} {row['index_mb']:>9} "
+                      f"{row['p50_ms']:>8} {row['p95_ms']:>8} {row['recall']:>9}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+
+def build_parser():
+    p = argparse.ArgumentParser(description="Benchmark de embeddings compactos vs float32.")
+    p.add_argument("--store", default="knowledge_store.json")
+    p.add_argument("--synthetic", type=int, default=0, help="N vectores sintéticos en lugar del store")
+    p.add_argument("--source-dims", type=int, default=1536)
+    p.add_argument("--clusters", type=int, default=200)
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--query-noise", type=float, default=0.5)
+    p.add_argument("--k", type=int, default=6)
+    p.add_argument("--formats", default="float32,float16,int8")
+    p.add_argument("--dims", default="0,512,256", help="0 = dims completas")
+    p.add_argument("--rerank", type=int, default=30, help="candidatos para rerank full (0 = sin rerank)")
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--json", default="", help="guardar resultados en este archivo")
+    return p
+
+
+if __name__ == "__main__":
+    main(build_parser().parse_args())
@@ -2,11 +2,25 @@ import os
 import json
 import re
 import httpx
+import numpy as np
 from bs4 import BeautifulSoup
 
+from vector_index import FORMATS, truncate, quantize, encode_b64
+
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_EMBED_MODEL = os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small")
 
+# Almacenamiento compacto de embeddings:
+#   EMBED_STORE_FORMAT=float32 (listas JSON, formato original) | float16 | int8
+#   EMBED_DIMENSIONS=512      truncar dims (0 = completas)
+#   EMBED_KEEP_FULL=1         guardar además knowledge_store.f32.npy (rerank a precisión completa);
+#                             con 0 y EMBED_DIMENSIONS, se usa el parámetro `dimensions` de la API
+EMBED_STORE_FORMAT = os.getenv("EMBED_STORE_FORMAT", "float32")
+EMBED_DIMENSIONS = int(os.getenv("EMBED_DIMENSIONS", "0"))
+EMBED_KEEP_FULL = os.getenv("EMBED_KEEP_FULL", "1") not in ("0", "false", "False", "")
+STORE_FILE = "knowledge_store.json"
+FULL_PRECISION_FILE = "knowledge_store.f32.npy"
+
 DEFAULT_URLS = [
     "https://www.nuxway.net/",
     "https://nuxway.services/",
@@ -39,17 +53,17 @@ async def fetch_url(client, url):
     return r.text
 
 
-async def embed(texts):
+async def embed(texts, dimensions=0):
     headers = {"Authorization": f"Bearer {OPENAI_API_KEY}"}
     url = "https://api.openai.com/v1/embeddings"
     embs = []
     async with httpx.AsyncClient() as client:
         for i in range(0, len(texts), 64):
             batch = texts[i:i+64]
-            r = await client.post(url, headers=headers, json={
-                "model": OPENAI_EMBED_MODEL,
-                "input": batch
-            })
+            payload = {"model": OPENAI_EMBED_MODEL, "input": batch}
+            if dimensions:
+                payload["dimensions"] = dimensions
+            r = await client.post(url, headers=headers, json=payload)
             r.raise_for_status()
             for d in r.json()["data"]:
                 embs.append(d["embedding"])
@@ -76,15 +90,36 @@ async def main():
                 docs.append({"source": file, "text": c})
 
     texts = [d["text"] for d in docs]
-    embeddings = await embed(texts)
-
-    for d, e in zip(docs, embeddings):
-        d["embedding"] = e
-
-    with open("knowledge_store.json", "w", encoding="utf-8") as f:
-        json.dump({"docs": docs}, f, ensure_ascii=False)
 
-    print("knowledge_store.json generado con", len(docs), "chunks")
+    if EMBED_STORE_FORMAT not in FORMATS:
+        raise SystemExit(f"EMBED_STORE_FORMAT debe ser uno de {FORMATS}")
+
+    if EMBED_STORE_FORMAT == "float32" and not EMBED_DIMENSIONS:
+        # formato original: listas float en el JSON
+        embeddings = await embed(texts)
+        for d, e in zip(docs, embeddings):
+            d["embedding"] = e
+        out = {"docs": docs}
+    else:
+        api_dims = 0 if EMBED_KEEP_FULL else EMBED_DIMENSIONS
+        raw = np.asarray(await embed(texts, dimensions=api_dims), dtype=np.float32)
+        source_dims = int(raw.shape[1]) if raw.ndim == 2 else 0
+        compact = truncate(raw, EMBED_DIMENSIONS)
+        data, scales = quantize(compact, EMBED_STORE_FORMAT)
+        for i, d in enumerate(docs):
+            d["embedding_b64"] = encode_b64(data[i])
+            if scales is not None:
+                d["embedding_scale"] = float(scales[i])
+        meta = {"format": EMBED_STORE_FORMAT, "dims": int(data.shape[1]), "source_dims": source_dims}
+        if EMBED_KEEP_FULL:
+            np.save(FULL_PRECISION_FILE, truncate(raw, 0))
+            meta["full_precision_file"] = FULL_PRECISION_FILE
+        out = {"embedding": meta, "docs": docs}
+
+    with open(STORE_FILE, "w", encoding="utf-8") as f:
+        json.dump(out, f, ensure_ascii=False)
+
+    print(STORE_FILE, "generado con", len(docs), "chunks", out.get("embedding", ""))
 
 if __name__ == "__main__":
     import asyncio
@@ -0,0 +1,349 @@
+"""
+Load test end-to-end del webhook contra upstreams locales (Graph, OpenAI, Zoho).
+
+Levanta:
+- un servidor fake con /v1/embeddings, /v1/chat/completions, /graph/... y /zoho
+  (latencia y tasa de error configurables por upstream)
+- main:app con uvicorn en un subproceso, apuntando a esos fakes por ENV
+
+Luego reproduce un corpus de mensajes en POST /webhook con concurrencia fija y
+reporta throughput, p50/p95/p99 y llamadas a cada upstream por mensaje.
+
+Ejemplos:
+    python loadtest.py
+    python loadtest.py --messages 2000 --concurrency 50 --openai-chat-ms 800 --error-rate openai_chat=0.05
+    python loadtest.py --corpus mensajes.txt --json > bench_output.txt
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import hashlib
+import argparse
+import subprocess
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# Mensajes típicos (mezcla de ramas determinísticas y LLM)
+DEFAULT_CORPUS = [
+    "Hola, buenas tardes",
+    "necesito 80 extensiones y 30 llamadas",
+    "¿Cuántos usuarios soporta la P550?",
+    "¿Qué diferencia hay entre la P560 y la P570?",
+    "precio de una central para 20 usuarios",
+    "quiero hablar con un asesor",
+    "Me llamo Carla Rojas de Cochabamba, mi celular 71234567",
+    "¿Tienen gateways para líneas analógicas?",
+    "¿Qué es Linkus y en qué sistemas funciona?",
+    "¿La PBX tiene integración con CRM?",
+    "Necesito un call center con grabación y reportes",
+    "¿Venden la S100?",
+    "¿Qué opciones tienen en la nube?",
+    "¿Hacen instalación en Santa Cruz?",
+    "mi empresa es Transportes Andinos, necesito 150 internos",
+]
+
+UPSTREAMS = ("graph", "openai_embeddings", "openai_chat", "zoho")
+
+
+# -------------------------
+# Upstreams fake
+# -------------------------
+class FakeUpstreams:
+    def __init__(self, latency_ms: dict, jitter: float, error_rate: dict, embed_dim: int):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.embed_dim = embed_dim
+        self.calls = {u: 0 for u in UPSTREAMS}
+        self.errors = {u: 0 for u in UPSTREAMS}
+        self._vectors = {}
+        self.app = self._build_app()
+
+    async def _delay_or_fail(self, upstream: str):
+        self.calls[upstream] += 1
+        base = self.latency_ms.get(upstream, 0) / 1000.0
+        if base > 0:
+            await asyncio.sleep(max(0.0, random.gauss(base, base * self.jitter)))
+        if random.random() < self.error_rate.get(upstream, 0.0):
+            self.errors[upstream] += 1
+            return JSONResponse({"error": {"message": "injected"}}, status_code=500)
+        return None
+
+    def _vector(self, text: str):
+        # Determinístico por texto y cacheado: el fake no debe ser el cuello de botella.
+        vec = self._vectors.get(text)
+        if vec is None:
+            rnd = random.Random(int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16))
+            vec = self._vectors[text] = [round(rnd.uniform(-1, 1), 6) for _ in range(self.embed_dim)]
+        return vec
+
+    def _build_app(self):
+        app = FastAPI()
+
+        @app.post("/v1/embeddings")
+        async def embeddings(request: Request):
+            body = await request.json()
+            err = await self._delay_or_fail("openai_embeddings")
+            if err:
+                return err
+            inputs = body.get("input")
+            inputs = inputs if isinstance(inputs, list) else [inputs]
+            return {"data": [{"index": i, "embedding": self._vector(t or "")} for i, t in enumerate(inputs)]}
+
+        @app.post("/v1/chat/completions")
+        async def chat(request: Request):
+            body = await request.json()
+            err = await self._delay_or_fail("openai_chat")
+            if err:
+                return err
+            return {
+                "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "Respuesta de prueba ✅"}}],
+            }
+
+        @app.post("/graph/{version}/{phone_id}/messages")
+        async def graph(version: str, phone_id: str):
+            err = await self._delay_or_fail("graph")
+            if err:
+                return err
+            return {"messages": [{"id": "wamid.fake"}]}
+
+        @app.post("/zoho")
+        async def zoho():
+            err = await self._delay_or_fail("zoho")
+            if err:
+                return err
+            return {"status": "ok"}
+
+        return app
+
+    def reset(self):
+        for u in UPSTREAMS:
+            self.calls[u] = 0
+            self.errors[u] = 0
+
+
+# -------------------------
+# Helpers
+# -------------------------
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def parse_kv_floats(items) -> dict:
+    out = {}
+    for item in items or []:
+        k, v = item.split("=", 1)
+        out[k.strip()] = float(v)
+    return out
+
+def load_corpus(path: str):
+    if not path:
+        return list(DEFAULT_CORPUS)
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line)["text"] for line in f if line.strip()]
+        return [line.strip() for line in f if line.strip()]
+
+def webhook_payload(wa_id: str, text: str, n: int, phone_number_id: str) -> dict:
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{
+            "id": "bench",
+            "changes": [{
+                "field": "messages",
+                "value": {
+                    "messaging_product": "whatsapp",
+                    "metadata": {"display_phone_number": "59100000000", "phone_number_id": phone_number_id},
+                    "contacts": [{"profile": {"name": "Bench"}, "wa_id": wa_id}],
+                    "messages": [{
+                        "from": wa_id,
+                        "id": f"wamid.bench.{n}",
+                        "timestamp": str(int(time.time())),
+                        "type": "text",
+                        "text": {"body": text},
+                    }],
+                },
+            }],
+        }],
+    }
+
+def percentile(sorted_vals, p: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    k = (len(sorted_vals) - 1) * p
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+
+async def wait_ready(client: httpx.AsyncClient, url: str, timeout: float = 30.0):
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < timeout:
+        try:
+            r = await client.get(url)
+            if r.status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} no respondió en {timeout}s")
+
+
+# -------------------------
+# Runner
+# -------------------------
+async def replay(client, app_url, corpus, messages, concurrency, conversations, phone_number_id):
+    latencies = []
+    failures = 0
+    queue = asyncio.Queue()
+    for n in range(messages):
+        wa_id = f"5917{n % conversations:07d}"
+        queue.put_nowait((n, wa_id, corpus[n % len(corpus)]))
+
+    async def worker():
+        nonlocal failures
+        while True:
+            try:
+                n, wa_id, text = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            t0 = time.perf_counter()
+            try:
+                r = await client.post(f"{app_url}/webhook", json=webhook_payload(wa_id, text, n, phone_number_id))
+                if r.status_code != 200:
+                    failures += 1
+            except httpx.HTTPError:
+                failures += 1
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, failures, time.perf_counter() - t0
+
+
+async def main(args):
+    fakes = FakeUpstreams(
+        latency_ms={
+            "graph": args.graph_ms,
+            "openai_embeddings": args.openai_embed_ms,
+            "openai_chat": args.openai_chat_ms,
+            "zoho": args.zoho_ms,
+        },
+        jitter=args.jitter,
+        error_rate=parse_kv_floats(args.error_rate),
+        embed_dim=args.embed_dim,
+    )
+    fake_port = free_port()
+    fake_server = uvicorn.Server(uvicorn.Config(fakes.app, host="127.0.0.1", port=fake_port, log_level="warning"))
+    fake_task = asyncio.create_task(fake_server.serve())
+    fake_url = f"http://127.0.0.1:{fake_port}"
+
+    app_port = free_port()
+    app_url = f"http://127.0.0.1:{app_port}"
+    phone_number_id = "100000000000001"
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"{fake_url}/v1",
+        "META_GRAPH_BASE_URL": f"{fake_url}/graph",
+        "WHATSAPP_TOKEN": "bench",
+        "WHATSAPP_PHONE_NUMBER_ID": phone_number_id,
+        "ZOHO_FLOW_WEBHOOK_URL": f"{fake_url}/zoho",
+        "LOG_LEVEL": args.app_log_level,
+    })
+    app_proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(app_port),
+         "--log-level", "warning", "--no-access-log", "--workers", str(args.workers)],
+        env=env,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+            await wait_ready(client, f"{fake_url}/docs")
+            await wait_ready(client, f"{app_url}/ready")
+
+            corpus = load_corpus(args.corpus)
+            conversations = args.conversations or max(args.concurrency, 1)
+
+            if args.warmup:
+                await replay(client, app_url, corpus, args.warmup, args.concurrency, conversations, phone_number_id)
+                fakes.reset()
+
+            latencies, failures, wall = await replay(
+                client, app_url, corpus, args.messages, args.concurrency, conversations, phone_number_id
+            )
+    finally:
+        app_proc.terminate()
+        try:
+            app_proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            app_proc.kill()
+        fake_server.should_exit = True
+        await fake_task
+
+    lat = sorted(latencies)
+    n = len(lat)
+    report = {
+        "messages": n,
+        "concurrency": args.concurrency,
+        "failures": failures,
+        "wall_s": round(wall, 3),
+        "throughput_msg_s": round(n / wall, 2) if wall else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(lat, 0.50) * 1000, 1),
+            "p95": round(percentile(lat, 0.95) * 1000, 1),
+            "p99": round(percentile(lat, 0.99) * 1000, 1),
+            "max": round((lat[-1] if lat else 0) * 1000, 1),
+        },
+        "upstream_calls_per_msg": {u: round(fakes.calls[u] / n, 3) if n else 0.0 for u in UPSTREAMS},
+        "upstream_errors": dict(fakes.errors),
+    }
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+        return
+
+    print(f"mensajes={n} concurrencia={args.concurrency} fallas={failures} tiempo={report['wall_s']}s")
+    print(f"throughput: {report['throughput_msg_s']} msg/s")
+    lm = report["latency_ms"]
+    print(f"latencia ms: p50={lm['p50']} p95={lm['p95']} p99={lm['p99']} max={lm['max']}")
+    print("llamadas upstream por mensaje:")
+    for u in UPSTREAMS:
+        print(f"  {u:<18} {report['upstream_calls_per_msg'][u]:>7}  (errores inyectados: {fakes.errors[u]})")
+
+
+def build_parser():
+    p = argparse.ArgumentParser(description="Load test end-to-end de /webhook con upstreams fake.")
+    p.add_argument("--messages", type=int, default=500)
+    p.add_argument("--concurrency", type=int, default=20)
+    p.add_argument("--conversations", type=int, default=0, help="wa_id distintos (default = concurrencia)")
+    p.add_argument("--warmup", type=int, default=50, help="mensajes previos no medidos")
+    p.add_argument("--corpus", default="", help="archivo .txt (1 mensaje por línea) o .jsonl con campo text")
+    p.add_argument("--workers", type=int, default=1, help="workers de uvicorn para main:app")
+    p.add_argument("--timeout", type=float, default=60.0)
+    p.add_argument("--graph-ms", type=float, default=80)
+    p.add_argument("--openai-embed-ms", type=float, default=150)
+    p.add_argument("--openai-chat-ms", type=float, default=900)
+    p.add_argument("--zoho-ms", type=float, default=250)
+    p.add_argument("--jitter", type=float, default=0.2, help="desvío relativo de la latencia (gauss)")
+    p.add_argument("--error-rate", action="append", metavar="UPSTREAM=P",
+                   help=f"inyectar errores 500, p.ej. openai_chat=0.05 ({', '.join(UPSTREAMS)})")
+    p.add_argument("--embed-dim", type=int, default=1536)
+    p.add_argument("--app-log-level", default="WARNING")
+    p.add_argument("--json", action="store_true", help="imprimir el reporte como JSON")
+    return p
+
+
+if __name__ == "__main__":
+    asyncio.run(main(build_parser().parse_args()))
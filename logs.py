@@ -0,0 +1,212 @@
+import os
+import re
+import sys
+import json
+import queue
+import random
+import atexit
+import hmac
+import hashlib
+import logging
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+
+import metrics
+
+# -------------------------
+# Logging estructurado (JSON por línea) fuera del event loop
+# -------------------------
+# El handler del root solo hace put_nowait en una cola; un thread (QueueListener)
+# redacta, serializa y escribe a stdout. Así ningún write bloquea el loop.
+#
+# ENV:
+#   LOG_LEVEL=INFO                       nivel por defecto
+#   LOG_LEVELS=wpp.main=DEBUG,httpx=WARNING   niveles por logger
+#   LOG_SAMPLE_RATES=webhook_received=0.1,whatsapp_sent=0.2   muestreo por evento (< WARNING)
+#   LOG_REDACT_PII=1                     enmascara teléfonos/emails (salvo campos de UNREDACTED_FIELDS)
+#   LOG_QUEUE_SIZE=10000                 si la cola se llena, se descarta (no bloquea)
+#   LOG_HASH_KEY=...                     secreto del HMAC de wa_ref (estable entre reinicios);
+#                                        sin él se usa una sal aleatoria por proceso
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "httpx=WARNING")
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+LOG_REDACT_PII = os.getenv("LOG_REDACT_PII", "1") not in ("0", "false", "False", "")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Los números bolivianos son ~10^8 valores: un hash sin secreto se revierte por fuerza bruta.
+LOG_HASH_KEY = (os.getenv("LOG_HASH_KEY", "") or os.urandom(32).hex()).encode("utf-8")
+
+# Correlación: se setean al inicio de cada mensaje y viajan por contextvars
+# a todas las corutinas que lo atienden.
+request_id_var = contextvars.ContextVar("request_id", default=None)
+wa_ref_var = contextvars.ContextVar("wa_ref", default=None)
+
+LOG_DROPPED = metrics.Counter("wpp_log_dropped_total", "Logs descartados por cola llena.")
+
+# Ids y rutas que no son datos personales pero el regex de teléfono enmascararía
+# (p.ej. phone_number_id de Graph, 15 dígitos, quedaba como "***22").
+UNREDACTED_FIELDS = frozenset({"phone_number_id", "tenant", "tenants", "path", "store", "model"})
+
+_PHONE_RE = re.compile(r"\+?\d[\d\s\-()]{6,}\d")
+_EMAIL_RE = re.compile(r"([A-Za-z0-9._%+-])[A-Za-z0-9._%+-]*@([A-Za-z0-9.-]+\.[A-Za-z]{2,})")
+
+
+def _parse_kv(raw: str) -> dict:
+    out = {}
+    for part in (raw or "").split(","):
+        if "=" in part:
+            k, v = part.split("=", 1)
+            if k.strip():
+                out[k.strip()] = v.strip()
+    return out
+
+def wa_ref(wa_id: str) -> str:
+    """Id para correlacionar un wa_id sin loguear el número (HMAC con LOG_HASH_KEY)."""
+    if not wa_id:
+        return ""
+    return "wa_" + hmac.new(LOG_HASH_KEY, wa_id.encode("utf-8"), hashlib.sha256).hexdigest()[:12]
+
+def _mask_phone(m) -> str:
+    d = re.sub(r"\D", "", m.group(0))
+    return "***" + d[-2:]
+
+def redact(value):
+    if not LOG_REDACT_PII:
+        return value
+    if isinstance(value, str):
+        value = _EMAIL_RE.sub(r"\1***@\2", value)
+        return _PHONE_RE.sub(_mask_phone, value)
+    if isinstance(value, dict):
+        return {k: redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    return value
+
+
+def bind(request_id: str = None, wa_id: str = None):
+    """Setea ids de correlación para el mensaje en curso."""
+    if request_id is not None:
+        request_id_var.set(request_id)
+    if wa_id is not None:
+        wa_ref_var.set(wa_ref(wa_id))
+
+
+class _ContextFilter(logging.Filter):
+    """Corre en el caller: copia ids de correlación al record y aplica muestreo."""
+
+    def __init__(self, sample_rates: dict):
+        super().__init__()
+        self.sample_rates = {k: float(v) for k, v in sample_rates.items()}
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING and self.sample_rates:
+            rate = self.sample_rates.get(record.getMessage())
+            if rate is not None and random.random() >= rate:
+                return False
+        record.request_id = request_id_var.get()
+        record.wa_ref = wa_ref_var.get()
+        return True
+
+
+class _DropQueueHandler(QueueHandler):
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+    def prepare(self, record):
+        # Igual que QueueHandler.prepare pero conservando "fields" sin formatear:
+        # la serialización se hace en el thread del listener.
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        out = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.msg,
+        }
+        rid = getattr(record, "request_id", None)
+        if rid:
+            out["request_id"] = rid
+        ref = getattr(record, "wa_ref", None)
+        if ref:
+            out["wa_ref"] = ref
+        fields = getattr(record, "fields", None)
+        if fields:
+            out.update({k: v if k in UNREDACTED_FIELDS else redact(v) for k, v in fields.items()})
+        if record.exc_text:
+            out["exc"] = redact(record.exc_text)
+        out["event"] = redact(out["event"])
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class StructLogger:
+    """
+    log = get_logger("wpp.main")
+    log.info("whatsapp_sent", status=200, ms=42)
+    """
+
+    def __init__(self, name: str):
+        self._logger = logging.getLogger(name)
+
+    def _log(self, level, event, fields, exc_info=None):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, event, extra={"fields": fields}, exc_info=exc_info)
+
+    def debug(self, event: str, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event: str, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event: str, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event: str, exc_info=None, **fields):
+        self._log(logging.ERROR, event, fields, exc_info=exc_info)
+
+
+def get_logger(name: str) -> StructLogger:
+    return StructLogger(name)
+
+
+_listener = None
+
+def setup_logging():
+    """Idempotente: instala QueueHandler en root y arranca el listener."""
+    global _listener
+    if _listener is not None:
+        return
+
+    q = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter())
+    _listener = QueueListener(q, stream, respect_handler_level=False)
+
+    handler = _DropQueueHandler(q)
+    handler.addFilter(_ContextFilter(_parse_kv(LOG_SAMPLE_RATES)))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+    for name, level in _parse_kv(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    metrics.QUEUE_DEPTH.set_function(q.qsize, queue="log")
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+def shutdown_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -2,13 +2,33 @@ import os
 import re
 import time
 import json
-import math
 import httpx
+import asyncio
+import threading
 from typing import Optional, Tuple
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import PlainTextResponse, JSONResponse
 
-app = FastAPI()
+import metrics
+import logs
+import tracing
+from tenants import StoreCache, load_tenant_configs
+
+logs.setup_logging()
+log = logs.get_logger("wpp.main")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # El store se carga en background: uvicorn acepta conexiones de inmediato
+    # y /ready indica cuándo RAG está disponible.
+    start_store_loading()
+    yield
+    await close_http_client()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # -------------------------
 # ENV - WhatsApp
@@ -17,6 +37,7 @@ VERIFY_TOKEN = os.getenv("WHATSAPP_VERIFY_TOKEN", "")
 WPP_TOKEN = os.getenv("WHATSAPP_TOKEN", "")
 PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID", "")
 GRAPH_VERSION = os.getenv("META_GRAPH_VERSION", "v24.0")
+GRAPH_BASE_URL = os.getenv("META_GRAPH_BASE_URL", "https://graph.facebook.com").rstrip("/")
 
 # -------------------------
 # ENV - OpenAI
@@ -25,6 +46,7 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
 SYSTEM_PROMPT = os.getenv("SYSTEM_PROMPT", "Eres un asistente útil. Responde en español.")
 OPENAI_EMBED_MODEL = os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
 
 # -------------------------
 # ENV - Click to Call
@@ -78,7 +100,7 @@ CALLBACK_KEYWORDS = [
 # -------------------------
 # Estado en memoria por wa_id
 # -------------------------
-LEADS = {}  # wa_id -> dict
+LEADS = {}  # lead_key(tenant_id, wa_id) -> dict
 
 
 # -------------------------
@@ -196,67 +218,143 @@ def lead_fingerprint_for_zoho(lead: dict) -> str:
 # RAG store (knowledge_store.json)
 # -------------------------
 STORE_PATH = "knowledge_store.json"
-STORE_DOCS = []
-STORE_EMBEDS = []
 
-def _dot(a, b):
-    return sum(x*y for x, y in zip(a, b))
+# Compactar un store legado (listas float) al cargar, sin re-ingestar:
+#   STORE_EMBED_FORMAT=float32|float16|int8, STORE_EMBED_DIMS=512 (0 = completas)
+# Stores generados por ingest.py con EMBED_STORE_FORMAT ya vienen compactos.
+STORE_EMBED_FORMAT = os.getenv("STORE_EMBED_FORMAT", "float32")
+STORE_EMBED_DIMS = int(os.getenv("STORE_EMBED_DIMS", "0"))
+# Candidatos que se re-puntúan con el vector completo (si existe el .npy full)
+RAG_RERANK_CANDIDATES = int(os.getenv("RAG_RERANK_CANDIDATES", "30"))
+# Stores de otros tenants cargados a la vez (el por defecto queda fijo y no cuenta)
+TENANT_MAX_LOADED_STORES = int(os.getenv("TENANT_MAX_LOADED_STORES", "4"))
+
+STORES = StoreCache(TENANT_MAX_LOADED_STORES, fmt=STORE_EMBED_FORMAT, dims=STORE_EMBED_DIMS)
+DEFAULT_STORE = STORES.get(STORE_PATH, pin=True)
+
+def start_store_loading():
+    DEFAULT_STORE.ensure_loading()
+
+
+# -------------------------
+# Cliente HTTP compartido (OpenAI / Graph / Zoho)
+# -------------------------
+# Un solo AsyncClient para todos los tenants: reutiliza conexiones TLS entre
+# mensajes en vez de crear un cliente (y su contexto SSL) por llamada.
+# Cada llamada pasa su propio timeout.
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+def http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=20,
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+        )
+    return _http_client
 
-def _norm(a):
-    return math.sqrt(sum(x*x for x in a))
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
 
-def _cosine(a, b):
-    na = _norm(a)
-    nb = _norm(b)
-    if na == 0 or nb == 0:
-        return 0.0
-    return _dot(a, b) / (na * nb)
 
-def load_store():
-    global STORE_DOCS, STORE_EMBEDS
+# -------------------------
+# Embeddings
+# -------------------------
+async def embed_texts(texts: list) -> Optional[list]:
+    """Una llamada a /embeddings con varios inputs. None si falla."""
+    url = f"{OPENAI_BASE_URL}/embeddings"
+    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
+    payload = {"model": OPENAI_EMBED_MODEL, "input": texts if len(texts) > 1 else texts[0]}
     try:
-        if not os.path.exists(STORE_PATH):
-            print("📦 RAG store not found:", STORE_PATH)
-            return
-        with open(STORE_PATH, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        docs = data.get("docs", [])
-        STORE_DOCS = docs
-        STORE_EMBEDS = [d.get("embedding", []) for d in docs]
-        print(f"📦 RAG store loaded: {len(STORE_DOCS)} chunks | size={os.path.getsize(STORE_PATH)} bytes")
+        with metrics.upstream_call("openai_embeddings") as rec:
+            r = await http_client().post(url, headers=headers, json=payload, timeout=30)
+            rec(r.status_code)
     except Exception as e:
-        print("❌ Error loading RAG store:", str(e))
+        log.error("embedding_error", error=type(e).__name__)
+        return None
+    if r.status_code != 200:
+        log.error("embedding_error", status=r.status_code, body=r.text[:500])
+        return None
+    out = [None] * len(texts)
+    for item in r.json()["data"]:
+        out[item.get("index", 0)] = item["embedding"] or []
+    return out
+
 
-load_store()
+# -------------------------
+# Micro-batching de embeddings de consulta
+# -------------------------
+# Las conversaciones concurrentes encolan su texto; la primera arma un timer de
+# EMBED_BATCH_WINDOW_MS y se envía todo en una sola llamada (o antes, si se
+# llega a EMBED_BATCH_MAX). Textos repetidos dentro del lote van una sola vez.
+# EMBED_BATCH_WINDOW_MS=0 desactiva el batching.
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "15"))
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "32"))
+
+class EmbedBatcher:
+    def __init__(self, window_s: float, max_batch: int):
+        self.window_s = window_s
+        self.max_batch = max_batch
+        self.pending = []  # [(texto, future, t_enqueue)]
+        self.timer = None
+        self.tasks = set()  # referencia a los envíos en curso (evita GC)
+
+    async def embed(self, text: str) -> list:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self.pending.append((text, fut, time.perf_counter()))
+        if len(self.pending) >= self.max_batch:
+            self._flush_now()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window_s, self._flush_now)
+        return await fut
+
+    def _flush_now(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.create_task(self._send(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _send(self, batch):
+        t_flush = time.perf_counter()
+        unique = list(dict.fromkeys(text for text, _, _ in batch))
+        metrics.EMBED_BATCH_SIZE.observe(len(batch))
+        for _, _, t_enq in batch:
+            metrics.EMBED_BATCH_WAIT.observe(t_flush - t_enq)
+
+        try:
+            vectors = await embed_texts(unique)
+        except Exception as e:
+            log.error("embedding_batch_error", error=type(e).__name__)
+            vectors = None
+        by_text = dict(zip(unique, vectors)) if vectors else {}
+        for text, fut, _ in batch:
+            if not fut.done():
+                fut.set_result(by_text.get(text) or [])
+
+EMBED_BATCHER = EmbedBatcher(EMBED_BATCH_WINDOW_MS / 1000.0, EMBED_BATCH_MAX)
+metrics.QUEUE_DEPTH.set_function(lambda: len(EMBED_BATCHER.pending), queue="embed_batch")
 
 async def embed_query(text: str):
     if not OPENAI_API_KEY:
         return []
-    url = "https://api.openai.com/v1/embeddings"
-    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
-    payload = {"model": OPENAI_EMBED_MODEL, "input": text}
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.post(url, headers=headers, json=payload)
-    if r.status_code != 200:
-        print("❌ Embedding error:", r.status_code, r.text)
-        return []
-    return (r.json()["data"][0]["embedding"] or [])
+    if EMBED_BATCH_WINDOW_MS <= 0:
+        vectors = await embed_texts([text])
+        return (vectors or [[]])[0] or []
+    return await EMBED_BATCHER.embed(text)
 
-def rag_search(query_embedding, top_k=6):
-    if not STORE_DOCS or not query_embedding:
-        return []
-    scored = []
-    for i, emb in enumerate(STORE_EMBEDS):
-        if not emb:
-            continue
-        score = _cosine(query_embedding, emb)
-        scored.append((score, i))
-    scored.sort(reverse=True, key=lambda x: x[0])
-    out = []
-    for score, idx in scored[:top_k]:
-        doc = STORE_DOCS[idx]
-        out.append({"score": score, "source": doc.get("source", ""), "text": doc.get("text", "")})
-    return out
+def rag_search(query_embedding, top_k=6, store=None):
+    return (store or DEFAULT_STORE).search(query_embedding, top_k=top_k, rerank_candidates=RAG_RERANK_CANDIDATES)
 
 def build_rag_context(results):
     if not results:
@@ -287,12 +385,14 @@ YEASTAR_S_CAPACITY = {
     "S50": {"usuarios": "50", "llamadas": "25"},
 }
 
-YEASTAR_MODELS = ["P520", "P550", "P560", "P570", "S412", "S20", "S50"]
+def catalog_models(catalog=None) -> list:
+    cat = catalog if catalog is not None else YEASTAR_CATALOG
+    return [*cat["appliance"], *cat["s_series"]]
 
-def find_models(text: str):
+def find_models(text: str, catalog=None):
     t = (text or "").upper()
     found = []
-    for m in YEASTAR_MODELS:
+    for m in catalog_models(catalog):
         if m in t:
             found.append(m)
     seen = set()
@@ -308,31 +408,344 @@ def is_capacity_question(text: str) -> bool:
     keywords = ["cuanto", "cuánt", "usuarios", "extensiones", "internos", "llamadas", "simult", "capacidad", "soporta"]
     return any(k in t for k in keywords)
 
-def capacity_line_for_model(model: str) -> str:
-    if model in YEASTAR_APPLIANCE_CAPACITY:
-        cap = YEASTAR_APPLIANCE_CAPACITY[model]
+def capacity_line_for_model(model: str, catalog=None) -> str:
+    cat = catalog if catalog is not None else YEASTAR_CATALOG
+    if model in cat["appliance"]:
+        cap = cat["appliance"][model]
         return f"✅ {model} (Appliance físico): {cap['usuarios']} usuarios/extensiones | {cap['llamadas']} llamadas simultáneas"
-    if model in YEASTAR_S_CAPACITY:
-        cap = YEASTAR_S_CAPACITY[model]
+    if model in cat["s_series"]:
+        cap = cat["s_series"][model]
         return f"✅ {model} (S-Series físico): {cap['usuarios']} usuarios | {cap['llamadas']} llamadas simultáneas"
     return f"✅ {model}: (dato no cargado)"
 
-def build_capacity_reply_multi(models):
-    lines = ["Según nuestro catálogo Yeastar (equipos físicos):"]
+def _catalog_label(catalog=None) -> str:
+    cat = catalog if catalog is not None else YEASTAR_CATALOG
+    return f"nuestro catálogo {cat['name']}".rstrip()
+
+def build_capacity_reply_multi(models, catalog=None):
+    lines = [f"Según {_catalog_label(catalog)} (equipos físicos):"]
     for m in models:
-        lines.append(capacity_line_for_model(m))
+        lines.append(capacity_line_for_model(m, catalog))
     lines.append("")
     lines.append("Si me dices cuántas extensiones y cuántas llamadas simultáneas necesitas, te recomiendo la mejor opción y te preparo cotización.")
     return "\n".join(lines)
 
 
+# -------------------------
+# Dimensionamiento determinístico ("necesito 80 extensiones y 30 llamadas")
+# -------------------------
+# Escalones numéricos de las tablas de arriba (mismo orden: menor a mayor).
+# P560/P570 tienen varios escalones según licencia.
+# S412 no se recomienda por tamaño (equipo analógico); alternativa vigente: S20/S50.
+YEASTAR_SIZING_TIERS = [
+    {"model": "S20", "platform": "S-Series físico", "usuarios": 20, "llamadas": 10, "detalle": ""},
+    {"model": "P520", "platform": "Appliance físico", "usuarios": 20, "llamadas": 10, "detalle": ""},
+    {"model": "S50", "platform": "S-Series físico", "usuarios": 50, "llamadas": 25, "detalle": ""},
+    {"model": "P550", "platform": "Appliance físico", "usuarios": 50, "llamadas": 25, "detalle": ""},
+    {"model": "P560", "platform": "Appliance físico", "usuarios": 100, "llamadas": 30, "detalle": "base"},
+    {"model": "P560", "platform": "Appliance físico", "usuarios": 200, "llamadas": 60, "detalle": "con licencia"},
+    {"model": "P570", "platform": "Appliance físico", "usuarios": 300, "llamadas": 60, "detalle": "licencia 300"},
+    {"model": "P570", "platform": "Appliance físico", "usuarios": 400, "llamadas": 90, "detalle": "licencia 400"},
+    {"model": "P570", "platform": "Appliance físico", "usuarios": 500, "llamadas": 120, "detalle": "licencia 500"},
+]
+
+# Software Edition (catalogo_yeastar.md): límite depende del servidor.
+YEASTAR_SOFTWARE_MAX = {"usuarios": 10000, "llamadas": 1000}
+
+# Catálogo del tenant por defecto. Otros tenants traen el suyo (mismas claves)
+# o ninguno: ver tenants.py.
+YEASTAR_CATALOG = {
+    "name": "Yeastar",
+    "software_label": "Yeastar P-Series Software Edition",
+    "software_alt": "Cloud Edition (escalable por demanda)",
+    "appliance": YEASTAR_APPLIANCE_CAPACITY,
+    "s_series": YEASTAR_S_CAPACITY,
+    "sizing_tiers": YEASTAR_SIZING_TIERS,
+    "software_max": YEASTAR_SOFTWARE_MAX,
+}
+
+_NUM = r"(\d{1,3}(?:[.,]\d{3})+|\d{1,5})"
+_USERS_WORDS = r"(?:usuarios?|extensiones?|extenciones?|internos?|anexos?|ext\b)"
+# "canales"/"líneas" solo cuentan como llamadas si dicen "simultáneos/as":
+# "8 líneas analógicas" o "2 canales E1" son troncales/puertos, no concurrencia.
+_SIMULT = r"(?:simult[aá]ne[ao]s?|concurrentes?|a\s+la\s+vez)"
+# "300 llamadas al día" es volumen de tráfico, no llamadas simultáneas
+_VOLUME = (
+    r"\s+(?:al\s+(?:d[ií]a|mes|a[ñn]o)|a\s+la\s+semana|por\s+(?:d[ií]a|mes|semana|hora|a[ñn]o)"
+    r"|diari[ao]s?|mensual(?:es)?|semanal(?:es)?|anual(?:es)?)"
+)
+_CALLS_WORDS = r"(?:llamadas?\b(?!" + _VOLUME + r")|(?:canales?|l[ií]neas?)\s+" + _SIMULT + r")"
+
+SIZING_USERS_RE = re.compile(_NUM + r"\s*" + _USERS_WORDS, re.IGNORECASE)
+SIZING_CALLS_RE = re.compile(_NUM + r"\s*" + _CALLS_WORDS, re.IGNORECASE)
+SIZING_USERS_REV_RE = re.compile(_USERS_WORDS + r"\s*[:=]\s*" + _NUM, re.IGNORECASE)
+SIZING_CALLS_REV_RE = re.compile(
+    r"(?:llamadas?(?:\s+" + _SIMULT + r")?|(?:canales?|l[ií]neas?)\s+" + _SIMULT + r")\s*[:=]\s*" + _NUM,
+    re.IGNORECASE,
+)
+# Volumen de llamadas: el mensaje no trae concurrencia fiable (va al LLM)
+CALL_VOLUME_RE = re.compile(_NUM + r"\s*llamadas?\b" + _VOLUME, re.IGNORECASE)
+# Consultas de troncales/gateways: no son dimensionamiento de PBX (van al LLM)
+TRUNK_GATEWAY_RE = re.compile(r"gateway|\b(?:e1|t1|pri|fxo|fxs)\b|anal[oó]gic", re.IGNORECASE)
+
+def _parse_int(s: str) -> int:
+    return int(re.sub(r"[.,]", "", s))
+
+def _first_number(text: str, forward_re, reverse_re) -> Optional[int]:
+    m = forward_re.search(text) or reverse_re.search(text)
+    if not m:
+        return None
+    n = _parse_int(m.group(1))
+    return n if n > 0 else None
+
+def extract_sizing_requirements(text: str) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Extrae (usuarios, llamadas) de frases tipo:
+    - "necesito 80 extensiones y 30 llamadas"
+    - "usuarios: 120, llamadas simultáneas: 40"
+    Solo cuenta números pegados a una unidad; teléfonos sueltos no se toman.
+    Preguntas de gateways/troncales (E1, FXO, analógicas...) o de volumen
+    ("300 llamadas al día") devuelven (None, None).
+    """
+    t = text or ""
+    if TRUNK_GATEWAY_RE.search(t) or CALL_VOLUME_RE.search(t):
+        return None, None
+    return (
+        _first_number(t, SIZING_USERS_RE, SIZING_USERS_REV_RE),
+        _first_number(t, SIZING_CALLS_RE, SIZING_CALLS_REV_RE),
+    )
+
+def recommend_yeastar_models(users: Optional[int], calls: Optional[int], catalog=None) -> dict:
+    """
+    Devuelve el modelo más chico que cumple, por familia:
+    {"p_series": tier|None, "s_series": tier|None, "software": bool}
+    Si ningún equipo físico alcanza, software=True (Software/Cloud Edition).
+    """
+    cat = catalog if catalog is not None else YEASTAR_CATALOG
+    u = users or 0
+    c = calls or 0
+    soft = cat["software_max"]
+    fits = [t for t in cat["sizing_tiers"] if t["usuarios"] >= u and t["llamadas"] >= c]
+    p_fit = next((t for t in fits if t["model"] in cat["appliance"]), None)
+    s_fit = next((t for t in fits if t["model"] in cat["s_series"]), None)
+    return {
+        "p_series": p_fit,
+        "s_series": s_fit,
+        "software": p_fit is None,
+        "software_fits": bool(soft) and u <= soft["usuarios"] and c <= soft["llamadas"],
+        "max_tier": cat["sizing_tiers"][-1] if cat["sizing_tiers"] else None,
+        "software_max": soft,
+        "software_label": cat["software_label"],
+        "software_alt": cat["software_alt"],
+        "catalog": cat["name"],
+    }
+
+def _tier_label(tier: dict) -> str:
+    detalle = f", {tier['detalle']}" if tier.get("detalle") else ""
+    return (
+        f"{tier['model']} ({tier['platform']}{detalle}): "
+        f"{tier['usuarios']} usuarios | {tier['llamadas']} llamadas simultáneas"
+    )
+
+def _requirement_label(users: Optional[int], calls: Optional[int]) -> str:
+    parts = []
+    if users:
+        parts.append(f"{users} extensiones")
+    if calls:
+        parts.append(f"{calls} llamadas simultáneas")
+    return " y ".join(parts)
+
+def sizing_note(users: Optional[int], calls: Optional[int], rec: dict) -> str:
+    """Línea corta para lead['notes'] (handoff a ventas)."""
+    picks = [t["model"] + (f" {t['detalle']}" if t.get("detalle") else "") for t in (rec["p_series"], rec["s_series"]) if t]
+    if rec["software"]:
+        picks.append(rec["software_label"] if rec["software_fits"] else "proyecto a medida")
+    return f"Dimensionamiento: {_requirement_label(users, calls)} -> {' / '.join(picks)}"
+
+def build_sizing_reply(users: Optional[int], calls: Optional[int], rec: dict, models=None, catalog=None) -> str:
+    lines = []
+    if models:
+        # "¿la P550 soporta 30 llamadas?" -> primero el dato del modelo consultado
+        lines.extend(capacity_line_for_model(m, catalog) for m in models)
+        lines.append("")
+    lines.append(f"Para {_requirement_label(users, calls)}, según {_catalog_label(catalog)}:")
+    if rec["p_series"]:
+        lines.append(f"✅ Recomendado: {_tier_label(rec['p_series'])}")
+    if rec["s_series"]:
+        lines.append(f"✅ Alternativa PBX clásica: {_tier_label(rec['s_series'])}")
+    if rec["software"]:
+        top, soft, label = rec["max_tier"], rec["software_max"], rec["software_label"]
+        alt = f" o {rec['software_alt']}" if rec["software_alt"] else ""
+        top_label = f" (máx. {top['model']}: {top['usuarios']} usuarios / {top['llamadas']} llamadas)" if top else ""
+        if rec["software_fits"]:
+            lines.append(
+                f"⚠️ Supera la capacidad de los equipos físicos{top_label}.\n"
+                f"✅ Recomendado: {label} (hasta {soft['usuarios']:,} extensiones / "
+                f"{soft['llamadas']:,} llamadas, según dimensionamiento del servidor){alt}."
+            )
+        elif soft:
+            lines.append(
+                f"⚠️ Supera la capacidad estándar de {label} ({soft['usuarios']:,} extensiones / "
+                f"{soft['llamadas']:,} llamadas). Un asesor debe dimensionar el proyecto a medida."
+            )
+        else:
+            lines.append(
+                f"⚠️ Supera la capacidad de los equipos del catálogo{top_label}. "
+                "Un asesor debe dimensionar el proyecto a medida."
+            )
+    if not calls:
+        lines.append("ℹ️ Si me indicas cuántas llamadas simultáneas necesitas, afino la recomendación.")
+    elif not users:
+        lines.append("ℹ️ Si me indicas cuántas extensiones necesitas, afino la recomendación.")
+    lines.append("")
+    lines.append("¿Te preparo la cotización? Compárteme tu ciudad y un email o teléfono.")
+    return "\n".join(lines)
+
+
+# -------------------------
+# Tenants (un número de WhatsApp = un tenant)
+# -------------------------
+# El webhook rutea por metadata.phone_number_id. El tenant por defecto sale de
+# las variables de entorno de siempre; los demás de TENANTS_FILE (formato en
+# tenants.py). Sin tenants.json todo va al tenant por defecto, como siempre;
+# con tenants configurados, un phone_number_id desconocido no se responde
+# (saldría por el número y el token de otra marca).
+TENANTS_FILE = os.getenv("TENANTS_FILE", "tenants.json")
+
+WELCOME_MESSAGE = (
+    "¡Hola! Soy el asistente oficial de Nuxway Technology SRL ✅\n"
+    "Te ayudo con soluciones de telefonía/IP PBX (Yeastar), redes, seguridad y call center.\n"
+    "¿Qué estás buscando para tu empresa?\n\n"
+    "Si deseas, déjame tus datos y un asesor se comunicará contigo, "
+    "o puedes contactarnos directamente cuando prefieras."
+)
+
+# Datos de contacto que ve el cliente (click-to-call, teléfonos, email, webs)
+DEFAULT_CONTACT = {
+    "click_to_call": CLICK_TO_CALL,
+    "phone_mobile": NUXWAY_PHONE_MOBILE,
+    "phone_landline": NUXWAY_PHONE_LANDLINE,
+    "email": NUXWAY_EMAIL_SALES,
+    "webs": [NUXWAY_WEB, NUXWAY_SERVICES_WEB],
+}
+
+DEFAULT_TENANT = {
+    "id": "default",
+    "phone_number_id": PHONE_NUMBER_ID,
+    "whatsapp_token": WPP_TOKEN,
+    "system_prompt": SYSTEM_PROMPT,
+    "welcome_message": WELCOME_MESSAGE,
+    "store_path": STORE_PATH,
+    "zoho_flow_webhook_url": ZOHO_FLOW_WEBHOOK_URL,
+    "catalog": YEASTAR_CATALOG,
+    "contact": DEFAULT_CONTACT,
+}
+
+TENANTS_BY_ID = {"default": DEFAULT_TENANT}
+TENANTS_BY_PHONE = {PHONE_NUMBER_ID: DEFAULT_TENANT} if PHONE_NUMBER_ID else {}
+
+for _tenant in load_tenant_configs(TENANTS_FILE, DEFAULT_TENANT):
+    TENANTS_BY_ID[_tenant["id"]] = _tenant
+    TENANTS_BY_PHONE[_tenant["phone_number_id"]] = _tenant
+if len(TENANTS_BY_ID) > 1:
+    log.info("tenants_loaded", tenants=sorted(TENANTS_BY_ID))
+
+def tenant_for_phone(phone_number_id: Optional[str]) -> Optional[dict]:
+    tenant = TENANTS_BY_PHONE.get(phone_number_id or "")
+    if tenant is None and len(TENANTS_BY_ID) == 1:
+        return DEFAULT_TENANT
+    return tenant
+
+def lead_tenant(lead: dict) -> dict:
+    return TENANTS_BY_ID.get(lead.get("tenant_id") or "default", DEFAULT_TENANT)
+
+def tenant_store(tenant: dict):
+    # get() marca el store como usado (LRU); la carga arranca en retrieve_context
+    return STORES.get(tenant["store_path"])
+
+
 # -------------------------
 # Endpoints base
 # -------------------------
 @app.get("/health")
 def health():
+    # liveness: el proceso responde (no depende del store)
     return {"status": "ok"}
 
+@app.get("/ready")
+def ready():
+    # readiness: 503 mientras el store carga o si falló al cargar
+    # (los stores de otros tenants cargan bajo demanda y no bloquean)
+    state = DEFAULT_STORE.state["state"]
+    if state == "idle":
+        state = "loading"
+    body = {
+        "status": "ready" if state in ("ready", "missing") else state,
+        "store": dict(DEFAULT_STORE.state),
+        "tenants": {"configured": len(TENANTS_BY_ID), "stores_loaded": STORES.loaded_count()},
+    }
+    if state in ("loading", "error"):
+        return JSONResponse(body, status_code=503)
+    return body
+
+@app.get("/metrics")
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render_all(), media_type="text/plain; version=0.0.4")
+
+METRIC_ROUTES = ("/webhook", "/health", "/ready", "/metrics")
+
+
+# -------------------------
+# Debug: traces y profiler (solo si DEBUG_TOKEN está configurado)
+# -------------------------
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN", "")
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+def debug_allowed(request: Request) -> bool:
+    if not DEBUG_TOKEN:
+        return False
+    token = request.headers.get("x-debug-token") or request.query_params.get("token")
+    return token == DEBUG_TOKEN
+
+@app.get("/debug/traces")
+def debug_traces(request: Request, limit: int = 50):
+    if not debug_allowed(request):
+        return PlainTextResponse("Not Found", status_code=404)
+    return {"traces": tracing.recent_traces(max(1, min(limit, tracing.TRACE_BUFFER_SIZE)))}
+
+@app.post("/debug/profile")
+async def debug_profile_start(request: Request, seconds: float = 10, interval_ms: float = 5):
+    # async: corre en el thread del event loop, que es el que se muestrea
+    if not debug_allowed(request):
+        return PlainTextResponse("Not Found", status_code=404)
+    seconds = max(0.1, min(seconds, PROFILE_MAX_SECONDS))
+    interval_ms = max(1.0, interval_ms)
+    started = tracing.PROFILER.start(seconds, interval_ms, threading.get_ident())
+    if not started:
+        return JSONResponse({"error": "profiler already running", **tracing.PROFILER.status()}, status_code=409)
+    return tracing.PROFILER.status()
+
+@app.get("/debug/profile")
+def debug_profile_result(request: Request):
+    """Stacks en formato folded (flamegraph.pl / speedscope) de la última captura."""
+    if not debug_allowed(request):
+        return PlainTextResponse("Not Found", status_code=404)
+    if tracing.PROFILER.running:
+        return JSONResponse(tracing.PROFILER.status(), status_code=409)
+    return PlainTextResponse(tracing.PROFILER.folded())
+
+@app.middleware("http")
+async def track_inflight(request: Request, call_next):
+    route = request.url.path if request.url.path in METRIC_ROUTES else "other"
+    metrics.INFLIGHT.inc(route=route)
+    try:
+        if route == "/webhook" and request.method == "POST":
+            with metrics.STAGE_SECONDS.time(stage="webhook_total"):
+                return await call_next(request)
+        return await call_next(request)
+    finally:
+        metrics.INFLIGHT.dec(route=route)
+
 @app.get("/webhook")
 def verify_webhook(request: Request):
     params = request.query_params
@@ -349,13 +762,16 @@ def verify_webhook(request: Request):
 # -------------------------
 # WhatsApp sender
 # -------------------------
-async def send_whatsapp_text(to: str, text: str):
-    if not (WPP_TOKEN and PHONE_NUMBER_ID):
-        print("⚠️ Faltan WHATSAPP_TOKEN o WHATSAPP_PHONE_NUMBER_ID")
+async def send_whatsapp_text(to: str, text: str, tenant: Optional[dict] = None):
+    tenant = tenant or DEFAULT_TENANT
+    token = tenant["whatsapp_token"]
+    phone_number_id = tenant["phone_number_id"]
+    if not (token and phone_number_id):
+        log.warning("whatsapp_not_configured", tenant=tenant["id"], missing="WHATSAPP_TOKEN/WHATSAPP_PHONE_NUMBER_ID")
         return
 
-    url = f"https://graph.facebook.com/{GRAPH_VERSION}/{PHONE_NUMBER_ID}/messages"
-    headers = {"Authorization": f"Bearer {WPP_TOKEN}", "Content-Type": "application/json"}
+    url = f"{GRAPH_BASE_URL}/{GRAPH_VERSION}/{phone_number_id}/messages"
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
     payload = {
         "messaging_product": "whatsapp",
         "to": to,
@@ -363,9 +779,13 @@ async def send_whatsapp_text(to: str, text: str):
         "text": {"body": text[:3500]},
     }
 
-    async with httpx.AsyncClient(timeout=20) as client:
-        r = await client.post(url, headers=headers, json=payload)
-        print("📤 Send status:", r.status_code, r.text)
+    with tracing.span("send"), metrics.upstream_call("graph") as rec:
+        r = await http_client().post(url, headers=headers, json=payload, timeout=20)
+        rec(r.status_code)
+    if 200 <= r.status_code < 300:
+        log.info("whatsapp_sent", status=r.status_code)
+    else:
+        log.error("whatsapp_send_error", status=r.status_code, body=r.text[:500])
 
 
 # -------------------------
@@ -376,8 +796,10 @@ async def send_to_zoho_flow(lead: dict) -> bool:
     Envía el lead capturado a Zoho Flow (Webhook Trigger).
     Retorna True si Zoho respondió 2xx.
     """
-    if not ZOHO_FLOW_WEBHOOK_URL:
-        print("⚠️ ZOHO_FLOW_WEBHOOK_URL no configurado; no se envía a Zoho.")
+    tenant = lead_tenant(lead)
+    zoho_url = tenant["zoho_flow_webhook_url"]
+    if not zoho_url:
+        log.warning("zoho_not_configured", tenant=tenant["id"])
         return False
 
     payload = {
@@ -402,15 +824,21 @@ async def send_to_zoho_flow(lead: dict) -> bool:
         "callback_requested": bool(lead.get("callback_requested")),
         "notes": lead.get("notes"),
         "company_name": lead.get("company_name"),
+        "tenant_id": tenant["id"],
     }
 
     try:
-        async with httpx.AsyncClient(timeout=20) as client:
-            r = await client.post(ZOHO_FLOW_WEBHOOK_URL, json=payload)
-        print("🟦 Zoho Flow status:", r.status_code, r.text)
-        return 200 <= r.status_code < 300
+        with tracing.span("zoho"), metrics.upstream_call("zoho") as rec:
+            r = await http_client().post(zoho_url, json=payload, timeout=20)
+            rec(r.status_code)
+        ok = 200 <= r.status_code < 300
+        if ok:
+            log.info("zoho_sent", status=r.status_code)
+        else:
+            log.error("zoho_send_error", status=r.status_code, body=r.text[:500])
+        return ok
     except Exception as e:
-        print("❌ Zoho Flow error:", str(e))
+        log.error("zoho_error", error=str(e))
         return False
 
 
@@ -473,10 +901,16 @@ def extract_name_city(text: str) -> Tuple[Optional[str], Optional[str]]:
     return (name or None), city
 
 
-def get_lead(wa_id: str) -> dict:
-    if wa_id not in LEADS:
-        LEADS[wa_id] = {
+def lead_key(tenant_id: str, wa_id: str) -> str:
+    # el mismo cliente puede escribir a dos números: un lead por tenant
+    return wa_id if tenant_id == "default" else f"{tenant_id}:{wa_id}"
+
+def get_lead(wa_id: str, tenant_id: str = "default") -> dict:
+    key = lead_key(tenant_id, wa_id)
+    if key not in LEADS:
+        LEADS[key] = {
             "wa_id": wa_id,
+            "tenant_id": tenant_id,
             "created_at": int(time.time()),
 
             "human_requested": False,
@@ -502,6 +936,10 @@ def get_lead(wa_id: str) -> dict:
             # saludo 1 sola vez por wa_id
             "welcomed": False,
 
+            # memoria de conversación: últimos turnos + resumen compacto de los anteriores
+            "memory_turns": [],
+            "memory_summary": [],
+
             # ✅ NUEVO: confirmación de registro Zoho (para no repetir)
             "zoho_confirmed": False,
 
@@ -509,52 +947,49 @@ def get_lead(wa_id: str) -> dict:
             "zoho_sent": False,
             "zoho_last_fingerprint": None,
         }
-    return LEADS[wa_id]
+    return LEADS[key]
 
 def lead_log(lead: dict, reason: str = ""):
-    print(
-        "🟩 LEAD:",
-        {
-            "wa_id": lead.get("wa_id"),
-            "first_name": lead.get("first_name"),
-            "last_name": lead.get("last_name"),
-            "name": lead.get("name"),
-            "company_name": lead.get("company_name"),
-            "city": lead.get("city"),
-            "phone_8": lead.get("phone_8"),
-            "phone_valid": lead.get("phone_valid"),
-            "email": lead.get("email"),
-            "email_valid": lead.get("email_valid"),
-            "human_requested": lead.get("human_requested"),
-            "callback_requested": lead.get("callback_requested"),
-            "last_intent": lead.get("last_intent"),
-            "zoho_sent": lead.get("zoho_sent"),
-            "reason": reason,
-        }
+    # Sin datos personales: solo qué campos tenemos (wa_ref va en el contexto del log).
+    log.info(
+        "lead",
+        reason=reason,
+        has_name=bool(lead.get("first_name") or lead.get("name")),
+        has_company=bool(lead.get("company_name")),
+        city=lead.get("city"),
+        phone_valid=bool(lead.get("phone_valid")),
+        email_valid=bool(lead.get("email_valid")),
+        human_requested=bool(lead.get("human_requested")),
+        callback_requested=bool(lead.get("callback_requested")),
+        last_intent=lead.get("last_intent"),
+        zoho_sent=bool(lead.get("zoho_sent")),
     )
 
-def contact_pack() -> str:
+def contact_pack(tenant: Optional[dict] = None) -> str:
+    c = (tenant or DEFAULT_TENANT)["contact"]
     parts = []
-    if CLICK_TO_CALL:
-        parts.append(f"📲 Click to Call (hablar con asesor):\n{CLICK_TO_CALL}")
-    parts.append(
-        "📞 Teléfonos:\n"
-        f"• Móvil: {NUXWAY_PHONE_MOBILE}\n"
-        f"• Fijo: {NUXWAY_PHONE_LANDLINE}\n"
-        f"📧 Email: {NUXWAY_EMAIL_SALES}"
-    )
-    parts.append(
-        "🌐 Web:\n"
-        f"• {NUXWAY_WEB}\n"
-        f"• {NUXWAY_SERVICES_WEB}"
-    )
-    return "\n\n".join(parts)
+    if c["click_to_call"]:
+        parts.append(f"📲 Click to Call (hablar con asesor):\n{c['click_to_call']}")
+    phones = [f"• Móvil: {c['phone_mobile']}" if c["phone_mobile"] else "",
+              f"• Fijo: {c['phone_landline']}" if c["phone_landline"] else ""]
+    block = "\n".join(p for p in phones if p)
+    if block:
+        block = "📞 Teléfonos:\n" + block
+    if c["email"]:
+        block = (block + "\n" if block else "") + f"📧 Email: {c['email']}"
+    if block:
+        parts.append(block)
+    if c["webs"]:
+        parts.append("🌐 Web:\n" + "\n".join(f"• {w}" for w in c["webs"]))
+    # tenant sin datos de contacto: no dejar la respuesta colgando
+    return "\n\n".join(parts) or "💬 Un asesor te contactará por este mismo chat."
 
 def build_handoff_message(lead: dict) -> str:
+    tenant = lead_tenant(lead)
     if lead.get("phone_valid") or lead.get("email"):
         return (
             "Perfecto ✅ Ya tengo tus datos.\n\n"
-            f"{contact_pack()}\n\n"
+            f"{contact_pack(tenant)}\n\n"
             "En breve un asesor se comunicará contigo. ¿En qué ciudad estás?"
         )
 
@@ -564,7 +999,7 @@ def build_handoff_message(lead: dict) -> str:
         "• Nombre\n"
         "• Ciudad\n"
         "• Teléfono (8 dígitos) o email\n\n"
-        f"{contact_pack()}"
+        f"{contact_pack(tenant)}"
     )
 
 def should_send_to_zoho(lead: dict) -> bool:
@@ -580,26 +1015,287 @@ def should_send_to_zoho(lead: dict) -> bool:
 
 
 # -------------------------
-# OpenAI (con RAG)
+# Memoria de conversación (por wa_id, vive dentro del lead)
 # -------------------------
-async def ask_openai(user_text: str, lead: dict) -> str:
-    if not OPENAI_API_KEY:
-        return "⚠️ OpenAI no está configurado (falta OPENAI_API_KEY)."
+# Los últimos MEMORY_MAX_TURNS mensajes van textuales; los anteriores se pliegan
+# en un resumen de una línea por mensaje (sin llamar al LLM). Todo junto se
+# recorta a MEMORY_TOKEN_BUDGET para que el prompt no crezca sin límite.
+MEMORY_MAX_TURNS = int(os.getenv("MEMORY_MAX_TURNS", "6"))
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "800"))
+MEMORY_TURN_MAX_CHARS = 700
+MEMORY_SUMMARY_LINE_CHARS = 140
+
+def estimate_tokens(text: str) -> int:
+    # ~4 caracteres por token en español; suficiente para acotar
+    return len(text or "") // 4 + 1
+
+def summarize_turn(turn: dict) -> str:
+    who = "Cliente" if turn["role"] == "user" else "Asistente"
+    text = (turn.get("content") or "").strip()
+    first = re.split(r"\n+", text, maxsplit=1)[0]
+    if len(first) > MEMORY_SUMMARY_LINE_CHARS:
+        first = first[:MEMORY_SUMMARY_LINE_CHARS].rstrip() + "…"
+    models = find_models(text)
+    if models:
+        first += f" [modelos: {', '.join(models)}]"
+    return f"{who}: {first}"
+
+def memory_tokens(lead: dict) -> int:
+    turns = lead.get("memory_turns") or []
+    summary = lead.get("memory_summary") or []
+    return sum(estimate_tokens(t["content"]) for t in turns) + sum(estimate_tokens(line) for line in summary)
+
+def compact_memory(lead: dict):
+    turns = lead.setdefault("memory_turns", [])
+    summary = lead.setdefault("memory_summary", [])
+    while len(turns) > MEMORY_MAX_TURNS or (len(turns) > 2 and memory_tokens(lead) > MEMORY_TOKEN_BUDGET):
+        summary.append(summarize_turn(turns.pop(0)))
+    while summary and memory_tokens(lead) > MEMORY_TOKEN_BUDGET:
+        summary.pop(0)
+
+def remember_turn(lead: dict, user_text: str, bot_text: str):
+    turns = lead.setdefault("memory_turns", [])
+    turns.append({"role": "user", "content": (user_text or "")[:MEMORY_TURN_MAX_CHARS]})
+    turns.append({"role": "assistant", "content": (bot_text or "")[:MEMORY_TURN_MAX_CHARS]})
+    compact_memory(lead)
+
+def memory_messages(lead: dict) -> list:
+    out = []
+    summary = lead.get("memory_summary") or []
+    if summary:
+        out.append({
+            "role": "system",
+            "content": "Resumen de la conversación previa (usar para entender referencias):\n- " + "\n- ".join(summary),
+        })
+    out.extend({"role": t["role"], "content": t["content"]} for t in (lead.get("memory_turns") or []))
+    return out
+
+async def reply_and_remember(lead: dict, user_text: str, text: str):
+    remember_turn(lead, user_text, text)
+    await send_whatsapp_text(lead["wa_id"], text, lead_tenant(lead))
+
+
+# -------------------------
+# Ruteo de modelos (rápido / grande) con presupuesto de latencia
+# -------------------------
+# - Consultas cortas tipo FAQ con buen hit RAG -> OPENAI_FAST_MODEL
+# - El resto -> OPENAI_MODEL
+# - Si el modelo elegido tarda más de LLM_HEDGE_AFTER_S, se lanza en paralelo
+#   el otro modelo y gana el primero que responda bien.
+# - Si se agota LLM_BUDGET_S (desde que llegó el mensaje) o fallan ambos,
+#   se responde con el mejor chunk RAG o con contact_pack().
+OPENAI_FAST_MODEL = os.getenv("OPENAI_FAST_MODEL", "gpt-4.1-nano")
+LLM_BUDGET_S = float(os.getenv("LLM_BUDGET_S", "12"))
+LLM_HEDGE_AFTER_S = float(os.getenv("LLM_HEDGE_AFTER_S", "4"))
+ROUTE_FAST_MAX_CHARS = int(os.getenv("ROUTE_FAST_MAX_CHARS", "160"))
+ROUTE_FAST_MIN_SCORE = float(os.getenv("ROUTE_FAST_MIN_SCORE", "0.5"))
+FALLBACK_MIN_SCORE = float(os.getenv("FALLBACK_MIN_SCORE", "0.35"))
+
+COMPLEX_KEYWORDS = [
+    "compar", "diferencia", "versus", " vs ", "integr", "migrar", "migración", "arquitectura",
+    "diseñ", "proyecto", "sucursales", "alta disponibilidad", "recomiend", "explica", "por qué", "porque",
+]
+
+def choose_route(user_text: str, results) -> str:
+    t = (user_text or "").lower()
+    if len(t) > ROUTE_FAST_MAX_CHARS or t.count("?") > 1:
+        return "large"
+    if any(k in t for k in COMPLEX_KEYWORDS):
+        return "large"
+    # Sin resultados (RAG omitido por carga, store cargando o error) no hay
+    # score que mirar: se decide solo por el texto. Tomarlo como 0.0 mandaría
+    # todo al modelo grande justo cuando el servicio está degradado.
+    if results and results[0]["score"] < ROUTE_FAST_MIN_SCORE:
+        return "large"
+    return "fast"
+
+def route_model(route: str) -> str:
+    return OPENAI_FAST_MODEL if route == "fast" else OPENAI_MODEL
+
+def build_fallback_reply(results, tenant: Optional[dict] = None) -> str:
+    """Respuesta sin LLM: mejor chunk RAG si es relevante, si no datos de contacto."""
+    c = (tenant or DEFAULT_TENANT)["contact"]
+    if results and results[0]["score"] >= FALLBACK_MIN_SCORE:
+        snippet = (results[0].get("text") or "").strip()
+        if len(snippet) > 700:
+            snippet = snippet[:700].rsplit(" ", 1)[0] + "…"
+        if snippet:
+            short = " | ".join(x for x in (
+                f"📞 {c['phone_mobile']}" if c["phone_mobile"] else "",
+                f"📧 {c['email']}" if c["email"] else "",
+            ) if x)
+            return (
+                "Te comparto la información de nuestro catálogo que corresponde a tu consulta:\n\n"
+                f"{snippet}\n\n"
+                "Si necesitas más detalle, un asesor puede ayudarte:\n"
+                f"{short or contact_pack(tenant)}"
+            )
+    return (
+        "En este momento no puedo darte una respuesta completa, pero un asesor puede ayudarte de inmediato:\n\n"
+        f"{contact_pack(tenant)}"
+    )
+
+async def openai_chat(model: str, messages: list, timeout: float) -> Optional[str]:
+    """Una llamada a chat/completions. None si falla (el caller decide el fallback)."""
+    url = f"{OPENAI_BASE_URL}/chat/completions"
+    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
+    payload = {"model": model, "messages": messages, "temperature": 0.2}
+
+    with tracing.span("llm", model=model), metrics.upstream_call("openai_chat") as rec:
+        r = await http_client().post(url, headers=headers, json=payload, timeout=timeout)
+        rec(r.status_code)
+
+    if r.status_code != 200:
+        log.error("openai_error", model=model, status=r.status_code, body=r.text[:500])
+        return None
+
+    data = r.json()
+    out = (data["choices"][0]["message"]["content"] or "").strip()
+    return out or "¿Me das un poco más de detalle?"
+
+async def _chat_or_none(model: str, messages: list, timeout: float) -> Optional[str]:
+    try:
+        return await openai_chat(model, messages, timeout)
+    except Exception as e:
+        log.error("openai_error", model=model, error=type(e).__name__)
+        return None
+
+async def chat_with_hedge(route: str, messages: list, deadline: float, allow_hedge: bool = True) -> Tuple[Optional[str], str]:
+    """
+    Llama al modelo de la ruta; si tarda más de LLM_HEDGE_AFTER_S lanza el otro
+    (salvo allow_hedge=False, p.ej. bajo sobrecarga).
+    Devuelve (texto|None, outcome) con outcome en primary|hedge|budget|error.
+    """
+    primary = route_model(route)
+    secondary = route_model("large" if route == "fast" else "fast")
+
+    remaining = deadline - time.perf_counter()
+    if remaining <= 0:
+        return None, "budget"
+
+    tasks = {asyncio.create_task(_chat_or_none(primary, messages, remaining)): "primary"}
+    hedge_at = time.perf_counter() + LLM_HEDGE_AFTER_S
+    # a lo sumo un hedge por mensaje: si falla no se vuelve a lanzar (no
+    # martillar OpenAI justo cuando está devolviendo 429/5xx)
+    hedged = not allow_hedge or secondary == primary
+    try:
+        while tasks:
+            now = time.perf_counter()
+            if now >= deadline:
+                return None, "budget"
+            wait_until = deadline if hedged else min(deadline, hedge_at)
+            done, _ = await asyncio.wait(tasks, timeout=max(0.0, wait_until - now), return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                kind = tasks.pop(task)
+                out = task.result()
+                if out:
+                    return out, kind
+
+            now = time.perf_counter()
+            # el primario falló rápido: el secundario hace de reintento
+            if not hedged and now < deadline and (not tasks or now >= hedge_at):
+                hedged = True
+                tasks[asyncio.create_task(_chat_or_none(secondary, messages, deadline - now))] = "hedge"
+        return None, "error"
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+# -------------------------
+# Control de admisión y degradación por carga
+# -------------------------
+# La carga se mide como consultas LLM en curso / LLM_MAX_INFLIGHT:
+#   tier 0: normal
+#   tier 1 (>= OVERLOAD_NO_RAG_AT): sin RAG (ahorra embedding + búsqueda)
+#   tier 2 (>= OVERLOAD_FAST_MODEL_AT): además modelo rápido y sin hedge
+#   tier 3 (cupo lleno): solo ramas determinísticas; lo que iría al LLM
+#           recibe "te respondemos en breve" + contacto
+LLM_MAX_INFLIGHT = int(os.getenv("LLM_MAX_INFLIGHT", "24"))
+OVERLOAD_NO_RAG_AT = float(os.getenv("OVERLOAD_NO_RAG_AT", "0.5"))
+OVERLOAD_FAST_MODEL_AT = float(os.getenv("OVERLOAD_FAST_MODEL_AT", "0.75"))
+
+TIER_NORMAL, TIER_NO_RAG, TIER_FAST_MODEL, TIER_DETERMINISTIC = 0, 1, 2, 3
+
+class AdmissionControl:
+    def __init__(self, max_inflight: int):
+        self.max_inflight = max(1, max_inflight)
+        self.inflight = 0
+
+    def tier(self) -> int:
+        if self.inflight >= self.max_inflight:
+            return TIER_DETERMINISTIC
+        load = self.inflight / self.max_inflight
+        if load >= OVERLOAD_FAST_MODEL_AT:
+            return TIER_FAST_MODEL
+        if load >= OVERLOAD_NO_RAG_AT:
+            return TIER_NO_RAG
+        return TIER_NORMAL
+
+    def try_acquire(self) -> Optional[int]:
+        """Tier con el que se admite la consulta, o None si hay que descartarla.
+        Sin await entre leer y sumar: atómico dentro del event loop."""
+        tier = self.tier()
+        if tier >= TIER_DETERMINISTIC:
+            return None
+        self.inflight += 1
+        return tier
+
+    def release(self):
+        self.inflight = max(0, self.inflight - 1)
+
+ADMISSION = AdmissionControl(LLM_MAX_INFLIGHT)
+metrics.LOAD_TIER.set_function(ADMISSION.tier)
+metrics.LLM_INFLIGHT.set_function(lambda: ADMISSION.inflight)
+
+def build_busy_reply(tenant: Optional[dict] = None) -> str:
+    return (
+        "Estamos con alta demanda en este momento ⏳ Te respondemos en breve.\n\n"
+        "Si es urgente, puedes contactarnos directamente:\n\n"
+        f"{contact_pack(tenant)}"
+    )
+
 
+# -------------------------
+# OpenAI (con RAG)
+# -------------------------
+async def retrieve_context(user_text: str, deadline: float, skip: bool = False, store=None):
+    """(results, rag_context). Sin store listo o con skip -> modo degradado: LLM sin RAG."""
+    if skip:
+        tracing.annotate(rag="skipped_overload")
+        return [], ""
+    store = store or DEFAULT_STORE
+    store.ensure_loading()
+    if not store.ready():
+        tracing.annotate(rag="skipped_" + store.state["state"])
+        return [], ""
+    results = []
     rag_context = ""
     try:
-        q_emb = await embed_query(user_text)
-        results = rag_search(q_emb, top_k=6)
-        rag_context = build_rag_context(results)
-        if rag_context:
-            print("🧠 RAG hits:", [(round(r["score"], 3), r["source"]) for r in results[:3]])
-        else:
-            print("🧠 RAG hits: none")
+        with tracing.span("embed_query"):
+            q_emb = await asyncio.wait_for(embed_query(user_text), timeout=max(0.1, deadline - time.perf_counter()))
+        with tracing.span("rag_search"):
+            results = rag_search(q_emb, top_k=6, store=store)
+        if results:
+            metrics.RAG_TOP_SCORE.observe(results[0]["score"])
+        with tracing.span("rag_context"):
+            rag_context = build_rag_context(results)
+        log.info("rag_hits", hits=[(round(r["score"], 3), r["source"]) for r in results[:3]])
     except Exception as e:
-        print("❌ RAG error:", str(e))
+        log.error("rag_error", error=str(e) or type(e).__name__)
+    return results, rag_context
 
-    url = "https://api.openai.com/v1/chat/completions"
-    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
+async def ask_openai(user_text: str, lead: dict, started_at: Optional[float] = None, tier: int = 0) -> str:
+    if not OPENAI_API_KEY:
+        return "⚠️ OpenAI no está configurado (falta OPENAI_API_KEY)."
+
+    deadline = (started_at or time.perf_counter()) + LLM_BUDGET_S
+    tenant = lead_tenant(lead)
+
+    results, rag_context = await retrieve_context(
+        user_text, deadline, skip=tier >= TIER_NO_RAG, store=tenant_store(tenant)
+    )
 
     internal_context = (
         f"Contexto interno (no lo muestres): wa_id={lead.get('wa_id')}, "
@@ -611,34 +1307,39 @@ async def ask_openai(user_text: str, lead: dict) -> str:
     )
 
     messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "system", "content": tenant["system_prompt"]},
         {"role": "system", "content": internal_context},
     ]
     if rag_context:
         messages.append({"role": "system", "content": rag_context})
+    messages.extend(memory_messages(lead))
     messages.append({"role": "user", "content": user_text})
 
-    payload = {"model": OPENAI_MODEL, "messages": messages, "temperature": 0.2}
-
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.post(url, headers=headers, json=payload)
-
-    if r.status_code != 200:
-        print("❌ OpenAI error:", r.status_code, r.text)
-        return "Tuve un problema al generar la respuesta. ¿Puedes intentar de nuevo?"
-
-    data = r.json()
-    out = (data["choices"][0]["message"]["content"] or "").strip()
-    return out or "¿Me das un poco más de detalle?"
+    route = "fast" if tier >= TIER_FAST_MODEL else choose_route(user_text, results)
+    metrics.LLM_ROUTE_TOTAL.inc(route=route)
+    tracing.annotate(llm_route=route)
+
+    out, outcome = await chat_with_hedge(route, messages, deadline, allow_hedge=tier < TIER_FAST_MODEL)
+    if not out:
+        outcome = "fallback_" + outcome
+        out = build_fallback_reply(results, tenant)
+    metrics.LLM_OUTCOME_TOTAL.inc(outcome=outcome)
+    tracing.annotate(llm_outcome=outcome)
+    log.info("llm_reply", route=route, outcome=outcome)
+    return out
 
 
 # -------------------------
 # Webhook receiver
 # -------------------------
+def mark_intent(intent: str):
+    metrics.INTENT_TOTAL.inc(intent=intent)
+    tracing.annotate(intent=intent)
+
 @app.post("/webhook")
 async def receive_webhook(request: Request):
+    t_received = time.perf_counter()
     body = await request.json()
-    print("📩 Webhook recibido:", body)
 
     try:
         entry = body.get("entry", [])[0]
@@ -649,80 +1350,102 @@ async def receive_webhook(request: Request):
         if not messages:
             return {"status": "ok"}
 
+        phone_number_id = (value.get("metadata") or {}).get("phone_number_id")
+        tenant = tenant_for_phone(phone_number_id)
+        if tenant is None:
+            log.warning("unknown_phone_number_id", phone_number_id=phone_number_id)
+            return {"status": "ok"}
+        catalog = tenant["catalog"]
+
         msg = messages[0]
         from_number = msg.get("from")
         msg_type = msg.get("type")
+        logs.bind(request_id=msg.get("id") or "", wa_id=from_number or "")
+        tracing.start_trace(
+            msg.get("id") or "", wa_ref=logs.wa_ref(from_number or ""), msg_type=msg_type, tenant=tenant["id"]
+        )
+        log.info("webhook_received", msg_type=msg_type, tenant=tenant["id"])
 
         if not from_number:
             return {"status": "ok"}
 
-        lead = get_lead(from_number)
+        lead = get_lead(from_number, tenant["id"])
 
         if msg_type != "text":
-            await send_whatsapp_text(from_number, "Por ahora solo respondo mensajes de texto ✅")
+            mark_intent("non_text")
+            await send_whatsapp_text(from_number, "Por ahora solo respondo mensajes de texto ✅", tenant)
             return {"status": "ok"}
 
         text_in = (msg.get("text", {}) or {}).get("body", "") or ""
-        print(f"👤 From wa_id={from_number} text={text_in!r}")
+        log.debug("message_text", text=text_in)
 
         # ✅ comando de prueba: resetear sin reiniciar Render
         if is_reset_command(text_in):
-            LEADS.pop(from_number, None)
-            await send_whatsapp_text(from_number, "✅ Listo. Reinicié tus datos de prueba. Envíame nombre/ciudad/teléfono/email nuevamente.")
+            mark_intent("reset")
+            LEADS.pop(lead_key(tenant["id"], from_number), None)
+            await send_whatsapp_text(
+                from_number, "✅ Listo. Reinicié tus datos de prueba. Envíame nombre/ciudad/teléfono/email nuevamente.", tenant
+            )
             return {"status": "ok"}
 
         # ✅ Saludo comercial SOLO 1 vez por contacto (se mantiene tu lógica)
         if not lead.get("welcomed"):
             lead["welcomed"] = True
-            await send_whatsapp_text(
-                from_number,
-                "¡Hola! Soy el asistente oficial de Nuxway Technology SRL ✅\n"
-                "Te ayudo con soluciones de telefonía/IP PBX (Yeastar), redes, seguridad y call center.\n"
-                "¿Qué estás buscando para tu empresa?\n\n"
-                "Si deseas, déjame tus datos y un asesor se comunicará contigo, "
-                "o puedes contactarnos directamente cuando prefieras."
-            )
+            mark_intent("welcome")
+            await send_whatsapp_text(from_number, tenant["welcome_message"], tenant)
             return {"status": "ok"}
 
-        # 0) Detecta humano/callback en cualquier momento
-        if wants_callback(text_in):
-            lead["callback_requested"] = True
-            lead["last_intent"] = lead.get("last_intent") or "callback"
-            lead["notes"] = (lead.get("notes") or "")
-            lead["notes"] = (lead["notes"] + "\n" if lead["notes"] else "") + f"Callback: {text_in}".strip()
-
-        if wants_human(text_in):
-            lead["human_requested"] = True
-            lead["last_intent"] = "human"
-
-        # 0.1) Empresa (si la detecta)
-        company = extract_company(text_in)
-        if company and not lead.get("company_name"):
-            lead["company_name"] = company
-
-        # 1) Captura teléfono/email y normaliza
-        phone8, email = extract_phone_email(text_in)
-
-        if email and not lead.get("email"):
-            lead["email"] = email
-        lead["email_valid"] = is_valid_email(lead.get("email"))
-
-        if phone8 and not lead.get("phone"):
-            lead["phone"] = phone8  # compat
-        lead["phone_8"] = normalize_bolivia_phone_8(lead.get("phone") or "")
-        lead["phone_valid"] = phone_is_valid_8(lead.get("phone_8"))
-
-        # 2) Captura nombre/ciudad y separa first/last
-        name, city = extract_name_city(text_in)
-        if name and not lead.get("name"):
-            lead["name"] = name
-        if city and not lead.get("city"):
-            lead["city"] = city
-
-        if lead.get("name") and (not lead.get("first_name") or not lead.get("last_name")):
-            fn, ln = split_first_last(lead["name"])
-            lead["first_name"] = fn
-            lead["last_name"] = ln or "SinApellido"
+        with tracing.span("lead_extraction"):
+            # 0) Detecta humano/callback en cualquier momento
+            if wants_callback(text_in):
+                lead["callback_requested"] = True
+                lead["last_intent"] = lead.get("last_intent") or "callback"
+                lead["notes"] = (lead.get("notes") or "")
+                lead["notes"] = (lead["notes"] + "\n" if lead["notes"] else "") + f"Callback: {text_in}".strip()
+
+            if wants_human(text_in):
+                lead["human_requested"] = True
+                lead["last_intent"] = "human"
+
+            # 0.05) Dimensionamiento: se anota antes del envío a Zoho para que viaje en el mismo lead
+            sizing_users, sizing_calls = extract_sizing_requirements(text_in)
+            sizing = None
+            if (sizing_users or sizing_calls) and catalog["sizing_tiers"]:
+                sizing = recommend_yeastar_models(sizing_users, sizing_calls, catalog)
+                note = sizing_note(sizing_users, sizing_calls, sizing)
+                if note not in (lead.get("notes") or ""):
+                    lead["notes"] = (lead["notes"] + "\n" if lead.get("notes") else "") + note
+                if lead.get("last_intent") != "human":
+                    lead["last_intent"] = "sizing"
+
+            # 0.1) Empresa (si la detecta)
+            company = extract_company(text_in)
+            if company and not lead.get("company_name"):
+                lead["company_name"] = company
+
+            # 1) Captura teléfono/email y normaliza
+            phone8, email = extract_phone_email(text_in)
+
+            if email and not lead.get("email"):
+                lead["email"] = email
+            lead["email_valid"] = is_valid_email(lead.get("email"))
+
+            if phone8 and not lead.get("phone"):
+                lead["phone"] = phone8  # compat
+            lead["phone_8"] = normalize_bolivia_phone_8(lead.get("phone") or "")
+            lead["phone_valid"] = phone_is_valid_8(lead.get("phone_8"))
+
+            # 2) Captura nombre/ciudad y separa first/last
+            name, city = extract_name_city(text_in)
+            if name and not lead.get("name"):
+                lead["name"] = name
+            if city and not lead.get("city"):
+                lead["city"] = city
+
+            if lead.get("name") and (not lead.get("first_name") or not lead.get("last_name")):
+                fn, ln = split_first_last(lead["name"])
+                lead["first_name"] = fn
+                lead["last_name"] = ln or "SinApellido"
 
         # 3) Enviar a Zoho si corresponde, y reenviar si cambió el fingerprint
         if should_send_to_zoho(lead):
@@ -742,39 +1465,54 @@ async def receive_webhook(request: Request):
                     await send_whatsapp_text(
                         from_number,
                         "Perfecto ✅ Ya registré tus datos. En breve un asesor se comunicará contigo.\n\n"
-                        "Si deseas volver a registrarlos, escribe /reset y envíalos nuevamente."
+                        "Si deseas volver a registrarlos, escribe /reset y envíalos nuevamente.",
+                        tenant,
                     )
 
+        # Dimensionamiento Yeastar (sin IA): modelo más chico que cumple.
+        # Va antes de click-to-call porque "30 llamadas" también matchea "llamada".
+        if sizing and not wants_human(text_in):
+            mark_intent("sizing")
+            lead_log(lead, reason="sizing_recommendation")
+            reply = build_sizing_reply(sizing_users, sizing_calls, sizing, find_models(text_in, catalog), catalog)
+            await reply_and_remember(lead, text_in, reply)
+            return {"status": "ok"}
+
         # --- FIX 1: Capacidades Yeastar (sin IA, multi-model) ---
-        models = find_models(text_in)
+        models = find_models(text_in, catalog)
         if models and is_capacity_question(text_in):
-            reply = build_capacity_reply_multi(models)
-            await send_whatsapp_text(from_number, reply)
+            mark_intent("capacity")
+            reply = build_capacity_reply_multi(models, catalog)
+            await reply_and_remember(lead, text_in, reply)
             return {"status": "ok"}
 
         # Si pide click-to-call/link/llamada -> dar paquete completo
         if wants_click_to_call(text_in):
-            await send_whatsapp_text(
-                from_number,
-                "Claro ✅ Aquí tienes las opciones para comunicarte con un asesor:\n\n" + contact_pack()
+            mark_intent("click_to_call")
+            await reply_and_remember(
+                lead, text_in,
+                "Claro ✅ Aquí tienes las opciones para comunicarte con un asesor:\n\n" + contact_pack(tenant)
             )
             return {"status": "ok"}
 
         # Si pide humano -> dar paquete completo
         if wants_human(text_in):
+            mark_intent("human")
             lead_log(lead, reason="user_requested_human")
-            await send_whatsapp_text(from_number, build_handoff_message(lead))
+            await reply_and_remember(lead, text_in, build_handoff_message(lead))
             return {"status": "ok"}
 
         # Si ya está en modo humano y manda datos -> confirmar y paquete completo
         if lead.get("human_requested") and (phone8 or email or name or company):
+            mark_intent("human_data")
             lead_log(lead, reason="lead_data_received_after_handoff")
-            await send_whatsapp_text(from_number, build_handoff_message(lead))
+            await reply_and_remember(lead, text_in, build_handoff_message(lead))
             return {"status": "ok"}
 
         # Si pide precio -> pedir datos + paquete completo
         if is_price_intent(text_in):
             lead["last_intent"] = "price"
+            mark_intent("price")
             lead_log(lead, reason="price_intent")
             reply = (
                 "Claro ✅ Para cotizar correctamente necesito 3 datos:\n"
@@ -782,16 +1520,32 @@ async def receive_webhook(request: Request):
                 "• Cantidad de usuarios/extensiones (o capacidad)\n"
                 "• Ciudad (para instalación/envío)\n\n"
                 "Si deseas, también puedes dejar tu email y te envío la proforma.\n\n"
-                f"{contact_pack()}"
+                f"{contact_pack(tenant)}"
             )
-            await send_whatsapp_text(from_number, reply)
+            await reply_and_remember(lead, text_in, reply)
             return {"status": "ok"}
 
         # Respuesta normal con OpenAI + RAG
-        reply = await ask_openai(text_in, lead)
-        await send_whatsapp_text(from_number, reply)
+        mark_intent("llm")
+        tier = ADMISSION.try_acquire()
+        if tier is None:
+            metrics.SHED_TOTAL.inc(reason="llm_capacity")
+            tracing.annotate(shed="llm_capacity")
+            log.warning("llm_shed", inflight=ADMISSION.inflight)
+            await reply_and_remember(lead, text_in, build_busy_reply(tenant))
+            return {"status": "ok"}
+        try:
+            if tier > TIER_NORMAL:
+                metrics.DEGRADED_TOTAL.inc(tier=str(tier))
+                tracing.annotate(load_tier=tier)
+            reply = await ask_openai(text_in, lead, started_at=t_received, tier=tier)
+        finally:
+            ADMISSION.release()
+        await reply_and_remember(lead, text_in, reply)
 
     except Exception as e:
-        print("❌ Error:", str(e))
+        log.error("webhook_error", error=str(e), exc_info=True)
+    finally:
+        tracing.finish_trace()
 
     return {"status": "ok"}
@@ -0,0 +1,261 @@
+import time
+import bisect
+from contextlib import contextmanager
+
+# -------------------------
+# Métricas en memoria con formato Prometheus (text/plain 0.0.4)
+# Sin dependencias: un dict por familia, incrementos O(1) y bisect para buckets.
+# -------------------------
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SCORE_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+REGISTRY = []
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _fmt_labels(names, values, extra=None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _fmt_value(v) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict):
+        return tuple(labels.get(n, "") for n in self.labels)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} {self.kind}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, doc, labels=()):
+        super().__init__(name, doc, labels)
+        self.values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        k = self._key(labels)
+        self.values[k] = self.values.get(k, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self._key(labels), 0)
+
+    def render(self):
+        yield from super().render()
+        for k, v in list(self.values.items()):
+            yield f"{self.name}{_fmt_labels(self.labels, k)} {_fmt_value(v)}"
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, doc, labels=()):
+        super().__init__(name, doc, labels)
+        self.values = {}
+        self.functions = {}
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        k = self._key(labels)
+        self.values[k] = self.values.get(k, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn, **labels):
+        """Valor leído en cada scrape (p.ej. tamaño de una cola)."""
+        self.functions[self._key(labels)] = fn
+
+    def get(self, **labels) -> float:
+        k = self._key(labels)
+        if k in self.functions:
+            return self.functions[k]()
+        return self.values.get(k, 0)
+
+    def render(self):
+        yield from super().render()
+        for k, v in list(self.values.items()):
+            yield f"{self.name}{_fmt_labels(self.labels, k)} {_fmt_value(v)}"
+        for k, fn in list(self.functions.items()):
+            try:
+                v = fn()
+            except Exception:
+                continue
+            yield f"{self.name}{_fmt_labels(self.labels, k)} {_fmt_value(v)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}  # key -> [counts por bucket (no acumulados) + overflow, sum, count]
+
+    def observe(self, value: float, **labels):
+        k = self._key(labels)
+        st = self.values.get(k)
+        if st is None:
+            st = self.values[k] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        st[0][bisect.bisect_left(self.buckets, value)] += 1
+        st[1] += value
+        st[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def count(self, **labels) -> int:
+        st = self.values.get(self._key(labels))
+        return st[2] if st else 0
+
+    def render(self):
+        yield from super().render()
+        for k, (counts, total, n) in list(self.values.items()):
+            acc = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                le_label = 'le="' + _fmt_value(le) + '"'
+                yield f"{self.name}_bucket{_fmt_labels(self.labels, k, le_label)} {acc}"
+            yield f"{self.name}_sum{_fmt_labels(self.labels, k)} {_fmt_value(total)}"
+            yield f"{self.name}_count{_fmt_labels(self.labels, k)} {n}"
+
+
+def render_all() -> str:
+    lines = []
+    for m in REGISTRY:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+# -------------------------
+# Familias del webhook
+# -------------------------
+STAGE_SECONDS = Histogram(
+    "wpp_stage_duration_seconds",
+    "Latencia por etapa del pipeline (lead, rag, llm, send...).",
+    labels=("stage",),
+)
+UPSTREAM_SECONDS = Histogram(
+    "wpp_upstream_duration_seconds",
+    "Latencia de llamadas HTTP a servicios externos.",
+    labels=("upstream",),
+)
+UPSTREAM_REQUESTS = Counter(
+    "wpp_upstream_requests_total",
+    "Llamadas a servicios externos por resultado (código HTTP o 'error').",
+    labels=("upstream", "status"),
+)
+INTENT_TOTAL = Counter(
+    "wpp_intent_total",
+    "Mensajes atendidos por rama de receive_webhook.",
+    labels=("intent",),
+)
+RAG_TOP_SCORE = Histogram(
+    "wpp_rag_top_score",
+    "Score coseno del mejor chunk RAG por consulta.",
+    buckets=SCORE_BUCKETS,
+)
+CACHE_REQUESTS = Counter(
+    "wpp_cache_requests_total",
+    "Consultas a caches internos (result=hit|miss).",
+    labels=("cache", "result"),
+)
+QUEUE_DEPTH = Gauge(
+    "wpp_queue_depth",
+    "Elementos pendientes en colas internas.",
+    labels=("queue",),
+)
+LLM_ROUTE_TOTAL = Counter(
+    "wpp_llm_route_total",
+    "Consultas LLM por ruta elegida (fast|large).",
+    labels=("route",),
+)
+LLM_OUTCOME_TOTAL = Counter(
+    "wpp_llm_outcome_total",
+    "Resultado de la consulta LLM (primary|hedge|fallback_budget|fallback_error).",
+    labels=("outcome",),
+)
+STORE_LOAD_SECONDS = Gauge(
+    "wpp_store_load_seconds",
+    "Duración de la última carga de cada knowledge store.",
+    labels=("store",),
+)
+EMBED_BATCH_SIZE = Histogram(
+    "wpp_embed_batch_size",
+    "Consultas por llamada batcheada a /embeddings.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+EMBED_BATCH_WAIT = Histogram(
+    "wpp_embed_batch_wait_seconds",
+    "Espera agregada por el micro-batching antes de enviar el embedding.",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25),
+)
+LOAD_TIER = Gauge(
+    "wpp_load_tier",
+    "Nivel de degradación actual (0 normal, 1 sin RAG, 2 modelo rápido, 3 solo determinístico).",
+)
+LLM_INFLIGHT = Gauge(
+    "wpp_llm_inflight",
+    "Consultas LLM admitidas en curso.",
+)
+SHED_TOTAL = Counter(
+    "wpp_shed_total",
+    "Mensajes que no fueron al LLM por sobrecarga.",
+    labels=("reason",),
+)
+DEGRADED_TOTAL = Counter(
+    "wpp_degraded_total",
+    "Consultas LLM admitidas en modo degradado, por tier.",
+    labels=("tier",),
+)
+INFLIGHT = Gauge(
+    "wpp_inflight_requests",
+    "Requests HTTP en curso.",
+    labels=("route",),
+)
+
+
+@contextmanager
+def upstream_call(upstream: str):
+    """
+    Mide una llamada externa. Uso:
+        with upstream_call("graph") as rec:
+            r = await client.post(...)
+            rec(r.status_code)
+    Si sale por excepción se cuenta como status="error".
+    """
+    status = ["error"]
+    t0 = time.perf_counter()
+    try:
+        yield lambda code: status.__setitem__(0, str(code))
+    finally:
+        UPSTREAM_SECONDS.observe(time.perf_counter() - t0, upstream=upstream)
+        UPSTREAM_REQUESTS.inc(upstream=upstream, status=status[0])
@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import asyncio
+from collections import OrderedDict
+
+import numpy as np
+
+import logs
+import metrics
+from vector_index import VectorIndex
+
+log = logs.get_logger("wpp.tenants")
+
+# -------------------------
+# Knowledge store por tenant (lazy load + LRU)
+# -------------------------
+# Cada número de WhatsApp (tenant) apunta a un knowledge_store.json. Los stores
+# se cargan en background la primera vez que se usan y, si hay más de
+# max_loaded cargados, se descarga el menos usado (salvo los fijados, como el
+# del tenant por defecto). Mientras un store carga, ese tenant responde sin RAG.
+
+
+class KnowledgeStore:
+    def __init__(self, path: str, fmt: str = "float32", dims: int = 0):
+        self.path = path
+        self.fmt = fmt
+        self.dims = dims
+        self.docs = []
+        self.index = VectorIndex(np.zeros((0, 0), dtype=np.float32))
+        # idle -> loading -> ready | missing | error ("missing" = sin RAG); evicted al descargar
+        self.state = {"state": "idle", "chunks": 0, "size_bytes": 0, "load_seconds": None, "error": None}
+        self._task = None
+
+    def ready(self) -> bool:
+        return self.state["state"] == "ready"
+
+    def load(self):
+        """Parsea el store y lo publica de una vez (se llama en un thread)."""
+        t0 = time.perf_counter()
+        try:
+            if not os.path.exists(self.path):
+                log.warning("rag_store_not_found", path=self.path)
+                self.state.update(state="missing")
+                return
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            t_parse = time.perf_counter() - t0
+            docs = data.get("docs", [])
+            index = VectorIndex.from_store(data, self.path, fmt=self.fmt, dims=self.dims)
+            for d in docs:
+                # los vectores viven en el índice; no duplicarlos como listas Python
+                d.pop("embedding", None)
+                d.pop("embedding_b64", None)
+                d.pop("embedding_scale", None)
+            if self.state["state"] == "evicted":
+                return  # desalojado mientras cargaba
+            self.docs, self.index = docs, index
+            elapsed = time.perf_counter() - t0
+            self.state.update(
+                state="ready",
+                chunks=len(docs),
+                size_bytes=os.path.getsize(self.path),
+                load_seconds=round(elapsed, 3),
+                embed_format=index.format,
+                embed_dims=index.dims,
+                index_bytes=index.nbytes(),
+                full_precision=index.full is not None,
+            )
+            log.info(
+                "rag_store_loaded",
+                path=self.path,
+                chunks=len(docs),
+                size_bytes=self.state["size_bytes"],
+                embed_format=index.format,
+                embed_dims=index.dims,
+                index_bytes=index.nbytes(),
+                full_precision=index.full is not None,
+                parse_ms=int(t_parse * 1000),
+                total_ms=int(elapsed * 1000),
+            )
+        except Exception as e:
+            self.state.update(state="error", error=str(e))
+            log.error("rag_store_load_error", path=self.path, error=str(e))
+        finally:
+            metrics.STORE_LOAD_SECONDS.set(time.perf_counter() - t0, store=os.path.basename(self.path))
+
+    def ensure_loading(self):
+        """Arranca la carga en background si todavía no se hizo (requiere event loop)."""
+        if self.state["state"] in ("idle", "evicted"):
+            self.state.update(state="loading", error=None)
+            self._task = asyncio.create_task(asyncio.to_thread(self.load))
+
+    def unload(self):
+        self.docs = []
+        self.index = VectorIndex(np.zeros((0, 0), dtype=np.float32))
+        self.state.update(state="evicted", chunks=0, index_bytes=0)
+        log.info("rag_store_evicted", path=self.path)
+
+    def search(self, query_embedding, top_k: int = 6, rerank_candidates: int = 0):
+        docs, index = self.docs, self.index
+        if not docs or not len(index) or not len(query_embedding):
+            return []
+        out = []
+        for score, idx in index.search(query_embedding, top_k=top_k, rerank_candidates=rerank_candidates):
+            doc = docs[idx]
+            out.append({"score": score, "source": doc.get("source", ""), "text": doc.get("text", "")})
+        return out
+
+
+class StoreCache:
+    def __init__(self, max_loaded: int, fmt: str = "float32", dims: int = 0):
+        self.max_loaded = max(1, max_loaded)
+        self.fmt = fmt
+        self.dims = dims
+        self.stores = OrderedDict()  # path -> KnowledgeStore (más reciente al final)
+        self.pinned = set()
+
+    def get(self, path: str, pin: bool = False) -> KnowledgeStore:
+        store = self.stores.get(path)
+        if store is not None and store.state["state"] != "evicted":
+            metrics.CACHE_REQUESTS.inc(cache="tenant_store", result="hit")
+        else:
+            metrics.CACHE_REQUESTS.inc(cache="tenant_store", result="miss")
+            if store is None:
+                store = self.stores[path] = KnowledgeStore(path, self.fmt, self.dims)
+        if pin:
+            self.pinned.add(path)
+        self.stores.move_to_end(path)
+        self._evict()
+        return store
+
+    def _evict(self):
+        loaded = [p for p, s in self.stores.items() if p not in self.pinned and s.state["state"] != "evicted"]
+        while len(loaded) > self.max_loaded:
+            path = loaded.pop(0)
+            self.stores[path].unload()
+
+    def loaded_count(self) -> int:
+        return sum(1 for s in self.stores.values() if s.state["state"] in ("loading", "ready"))
+
+
+# -------------------------
+# Configuración de tenants
+# -------------------------
+# tenants.json:
+# {
+#   "tenants": [
+#     {
+#       "id": "marca2",
+#       "phone_number_id": "1234567890",
+#       "system_prompt": "Eres el asistente de Marca2...",
+#       "store_path": "stores/marca2.json",
+#       "welcome_message": "¡Hola! Soy el asistente de Marca2...",
+#       "zoho_flow_webhook_url": "https://flow.zoho.com/...",
+#       "whatsapp_token": "...",        (opcional; por defecto WHATSAPP_TOKEN)
+#       "contact": {"click_to_call": "", "phone_mobile": "...", "phone_landline": "",
+#                   "email": "ventas@marca2.com", "webs": ["https://marca2.com"]},
+#       "catalog": null                 (opcional; ver abajo)
+#     }
+#   ]
+# }
+# Lo que identifica a la marca (BRAND_KEYS: prompt, saludo, contacto, CRM) NO se
+# hereda: si falta queda neutro/vacío y se avisa con tenant_config_defaults, así
+# los clientes de otra marca nunca ven a Nuxway ni sus leads van al Zoho de Nuxway.
+# El resto (whatsapp_token, store_path, catalog) se hereda del tenant por defecto.
+# Dentro de "contact" los campos omitidos quedan vacíos.
+# store_path relativo se resuelve contra la carpeta de tenants.json.
+#
+# catalog: omitido = catálogo Yeastar del tenant por defecto; null = sin
+# respuestas determinísticas de capacidad/dimensionamiento (todo va al LLM);
+# u objeto con las mismas claves que YEASTAR_CATALOG en main.py:
+#   {"name": "...", "software_label": "...", "software_alt": "...", "appliance": {"M1": {"usuarios": "20", "llamadas": "10"}}, "s_series": {...},
+#    "sizing_tiers": [{"model": "M1", "platform": "...", "usuarios": 20, "llamadas": 10, "detalle": ""}],
+#    "software_max": {"usuarios": 10000, "llamadas": 1000} | null}
+
+TENANT_KEYS = (
+    "system_prompt", "welcome_message", "store_path", "zoho_flow_webhook_url", "whatsapp_token", "catalog",
+    "contact",
+)
+
+EMPTY_CATALOG = {
+    "name": "", "software_label": "Software Edition", "software_alt": "",
+    "appliance": {}, "s_series": {}, "sizing_tiers": [], "software_max": None,
+}
+EMPTY_CONTACT = {"click_to_call": "", "phone_mobile": "", "phone_landline": "", "email": "", "webs": []}
+
+# Valores neutros para las claves de marca que un tenant no define
+BRAND_KEYS = {
+    "system_prompt": "Eres un asistente útil. Responde en español.",
+    "welcome_message": "¡Hola! 👋 ¿En qué te puedo ayudar?",
+    "contact": EMPTY_CONTACT,
+    "zoho_flow_webhook_url": "",
+}
+
+def load_tenant_configs(path: str, default: dict) -> list:
+    """Lista de tenants (dicts) desde `path`, heredando de `default`. [] si no existe."""
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    out = []
+    for entry in raw.get("tenants", []):
+        if not entry.get("id") or not entry.get("phone_number_id"):
+            log.warning("tenant_config_skipped", reason="missing id/phone_number_id")
+            continue
+        tenant = {k: default.get(k) for k in TENANT_KEYS}
+        tenant.update(BRAND_KEYS)
+        tenant.update({k: entry[k] for k in TENANT_KEYS if k in entry})
+        tenant["id"] = str(entry["id"])
+        missing = [k for k in BRAND_KEYS if k not in entry]
+        if missing:
+            log.warning("tenant_config_defaults", tenant=tenant["id"], keys=missing)
+        tenant["phone_number_id"] = str(entry["phone_number_id"])
+        if "store_path" in entry and not os.path.isabs(tenant["store_path"]):
+            tenant["store_path"] = os.path.join(base_dir, tenant["store_path"])
+        if tenant["catalog"] is None:
+            tenant["catalog"] = EMPTY_CATALOG
+        else:
+            tenant["catalog"] = {**EMPTY_CATALOG, **tenant["catalog"]}
+        tenant["contact"] = {**EMPTY_CONTACT, **(tenant["contact"] or {})}
+        out.append(tenant)
+    return out
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Los módulos viven en la raíz del repo (main.py, tenants.py, ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,42 @@
+import time
+import asyncio
+
+import main
+
+
+def test_single_hedge_when_secondary_fails_fast(monkeypatch):
+    # primario lento, secundario que falla enseguida: debe haber un solo hedge
+    calls = {"primary": 0, "secondary": 0}
+    primary = main.route_model("large")
+
+    async def fake_chat(model, messages, timeout):
+        if model == primary:
+            calls["primary"] += 1
+            await asyncio.sleep(3)
+            return "tarde"
+        calls["secondary"] += 1
+        await asyncio.sleep(0.01)
+        return None
+
+    monkeypatch.setattr(main, "openai_chat", fake_chat)
+    monkeypatch.setattr(main, "LLM_HEDGE_AFTER_S", 0.2)
+
+    out, outcome = asyncio.run(main.chat_with_hedge("large", [], time.perf_counter() + 2))
+
+    assert (out, outcome) == (None, "budget")
+    assert calls == {"primary": 1, "secondary": 1}
+
+
+def test_fast_primary_failure_retries_once_on_secondary(monkeypatch):
+    calls = []
+
+    async def fake_chat(model, messages, timeout):
+        calls.append(model)
+        return None
+
+    monkeypatch.setattr(main, "openai_chat", fake_chat)
+
+    out, outcome = asyncio.run(main.chat_with_hedge("large", [], time.perf_counter() + 2))
+
+    assert (out, outcome) == (None, "error")
+    assert calls == [main.route_model("large"), main.route_model("fast")]
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+import main
+
+
+def _fake_embed(monkeypatch, delay=0.0, fail=None):
+    """embed_texts falso: vector = [len(texto)]; registra cada request."""
+    requests = []
+
+    async def fake_embed_texts(texts):
+        requests.append(list(texts))
+        await asyncio.sleep(delay)
+        if fail == "none":
+            return None
+        if fail == "raise":
+            raise RuntimeError("boom")
+        return [[float(len(t))] for t in texts]
+
+    monkeypatch.setattr(main, "embed_texts", fake_embed_texts)
+    return requests
+
+
+def test_concurrent_queries_share_one_request_and_dedupe(monkeypatch):
+    requests = _fake_embed(monkeypatch)
+
+    async def run():
+        batcher = main.EmbedBatcher(0.02, 32)
+        return await asyncio.gather(*(batcher.embed(t) for t in ["a", "bb", "a", "ccc"]))
+
+    assert asyncio.run(run()) == [[1.0], [2.0], [1.0], [3.0]]
+    assert requests == [["a", "bb", "ccc"]]
+
+
+@pytest.mark.parametrize("fail", ["none", "raise"])
+def test_failed_batch_resolves_every_waiter_empty(monkeypatch, fail):
+    requests = _fake_embed(monkeypatch, fail=fail)
+
+    async def run():
+        batcher = main.EmbedBatcher(0.01, 32)
+        return await asyncio.gather(batcher.embed("x"), batcher.embed("yy"))
+
+    assert asyncio.run(run()) == [[], []]
+    assert len(requests) == 1
+
+
+def test_cancelled_waiter_does_not_break_the_others(monkeypatch):
+    requests = _fake_embed(monkeypatch, delay=0.1)
+
+    async def run():
+        batcher = main.EmbedBatcher(0.01, 32)
+        # como retrieve_context: wait_for cancela la espera al agotar el presupuesto
+        impatient = asyncio.wait_for(batcher.embed("tarde"), timeout=0.05)
+        results = await asyncio.gather(impatient, batcher.embed("ok"), batcher.embed("okk"), return_exceptions=True)
+        return results, batcher
+
+    (impatient, ok, okk), batcher = asyncio.run(run())
+    assert isinstance(impatient, asyncio.TimeoutError)
+    assert (ok, okk) == ([2.0], [3.0])
+    assert len(requests) == 1 and not batcher.pending
+
+
+def test_flushes_early_at_max_batch(monkeypatch):
+    requests = _fake_embed(monkeypatch)
+
+    async def run():
+        batcher = main.EmbedBatcher(10.0, 2)  # ventana larga: solo el tope dispara
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        first = await asyncio.wait_for(asyncio.gather(batcher.embed("a"), batcher.embed("b")), timeout=1)
+        return first, loop.time() - t0, batcher
+
+    first, elapsed, batcher = asyncio.run(run())
+    assert first == [[1.0], [1.0]]
+    assert elapsed < 1
+    assert requests == [["a", "b"]]
+    assert batcher.timer is None
@@ -0,0 +1,31 @@
+import json
+import logging
+
+import logs
+
+
+def _format(event, **fields):
+    record = logging.LogRecord("wpp.test", logging.WARNING, __file__, 1, event, None, None)
+    record.fields = fields
+    return json.loads(logs.JsonFormatter().format(record))
+
+
+def test_known_id_fields_are_not_redacted(monkeypatch):
+    monkeypatch.setattr(logs, "LOG_REDACT_PII", True)
+    out = _format(
+        "unknown_phone_number_id",
+        phone_number_id="109876543210987",
+        path="/srv/stores/12345678.json",
+        error="cliente 59171234567 ventas@nuxway.net",
+    )
+
+    assert out["phone_number_id"] == "109876543210987"
+    assert out["path"] == "/srv/stores/12345678.json"
+    assert "59171234567" not in out["error"]
+    assert "ventas@" not in out["error"]
+
+
+def test_wa_ref_is_keyed(monkeypatch):
+    ref = logs.wa_ref("59171234567")
+    monkeypatch.setattr(logs, "LOG_HASH_KEY", b"otra-clave")
+    assert ref.startswith("wa_") and logs.wa_ref("59171234567") != ref
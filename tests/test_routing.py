@@ -0,0 +1,16 @@
+import main
+
+
+def test_faq_with_good_rag_hit_goes_fast():
+    assert main.choose_route("¿Qué es Linkus?", [{"score": 0.7}]) == "fast"
+
+
+def test_weak_rag_hit_goes_large():
+    assert main.choose_route("¿Qué es Linkus?", [{"score": 0.1}]) == "large"
+
+
+def test_skipped_rag_routes_on_text_alone():
+    # tier TIER_NO_RAG / store cargando: results vacío no debe forzar el modelo grande
+    assert main.choose_route("¿Qué es Linkus?", []) == "fast"
+    assert main.choose_route("¿Qué diferencia hay entre P550 y P560?", []) == "large"
+    assert main.choose_route("x" * (main.ROUTE_FAST_MAX_CHARS + 1), []) == "large"
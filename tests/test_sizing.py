@@ -0,0 +1,37 @@
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("necesito 80 extensiones y 30 llamadas", (80, 30)),
+    ("usuarios: 120, llamadas simultáneas: 40", (120, 40)),
+    ("50 extensiones y 20 canales simultáneos", (50, 20)),
+    ("15 llamadas concurrentes", (None, 15)),
+    ("30 extensiones, 12 llamadas a la vez", (30, 12)),
+    ("8 líneas y 20 usuarios", (20, None)),
+])
+def test_extracts_users_and_concurrent_calls(text, expected):
+    assert main.extract_sizing_requirements(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    # volumen de tráfico, no concurrencia
+    "recibimos 300 llamadas al día",
+    "tenemos 20 usuarios y 500 llamadas por mes",
+    "10 agentes con 2000 llamadas diarias",
+    "unas 40 llamadas por hora",
+    # troncales / gateways
+    "¿Tienen gateway para 8 líneas analógicas?",
+    "necesito 2 canales E1",
+    "30 extensiones y 4 puertos FXO",
+])
+def test_volume_and_trunk_questions_skip_sizing(text):
+    assert main.extract_sizing_requirements(text) == (None, None)
+
+
+def test_sizing_picks_smallest_fitting_models():
+    rec = main.recommend_yeastar_models(80, 30)
+    assert rec["p_series"]["model"] == "P560"
+    assert rec["s_series"] is None
+    assert not rec["software"]
@@ -0,0 +1,55 @@
+import json
+
+import main
+import tenants
+
+
+def _tenants_file(tmp_path, **extra):
+    entry = {"id": "marca2", "phone_number_id": "222", "catalog": None, **extra}
+    path = tmp_path / "tenants.json"
+    path.write_text(json.dumps({"tenants": [entry]}), encoding="utf-8")
+    return str(path)
+
+
+def test_tenant_contact_does_not_inherit_default_fields(tmp_path):
+    path = _tenants_file(tmp_path, contact={"email": "ventas@marca2.com"})
+    (tenant,) = tenants.load_tenant_configs(path, main.DEFAULT_TENANT)
+
+    pack = main.contact_pack(tenant)
+
+    assert "ventas@marca2.com" in pack
+    assert main.NUXWAY_EMAIL_SALES not in pack
+    assert main.NUXWAY_PHONE_MOBILE not in main.build_busy_reply(tenant)
+
+
+def test_unknown_phone_number_id_only_falls_back_without_tenants(tmp_path, monkeypatch):
+    (tenant,) = tenants.load_tenant_configs(_tenants_file(tmp_path), main.DEFAULT_TENANT)
+    monkeypatch.setattr(main, "TENANTS_BY_ID", {"default": main.DEFAULT_TENANT})
+    monkeypatch.setattr(main, "TENANTS_BY_PHONE", {})
+
+    assert main.tenant_for_phone("999") is main.DEFAULT_TENANT
+
+    monkeypatch.setattr(main, "TENANTS_BY_ID", {"default": main.DEFAULT_TENANT, "marca2": tenant})
+    monkeypatch.setattr(main, "TENANTS_BY_PHONE", {"111": main.DEFAULT_TENANT, "222": tenant})
+
+    assert main.tenant_for_phone("222") is tenant
+    assert main.tenant_for_phone("111") is main.DEFAULT_TENANT
+    assert main.tenant_for_phone("999") is None
+
+
+def test_brand_keys_are_not_inherited_from_default(tmp_path):
+    (tenant,) = tenants.load_tenant_configs(_tenants_file(tmp_path), main.DEFAULT_TENANT)
+
+    assert tenant["welcome_message"] == tenants.BRAND_KEYS["welcome_message"]
+    assert tenant["system_prompt"] == tenants.BRAND_KEYS["system_prompt"]
+    assert tenant["zoho_flow_webhook_url"] == ""
+    assert tenant["contact"] == tenants.EMPTY_CONTACT
+    # lo que no es de marca sí se hereda
+    assert tenant["whatsapp_token"] == main.DEFAULT_TENANT["whatsapp_token"]
+    assert tenant["store_path"] == main.DEFAULT_TENANT["store_path"]
+
+    replies = [main.contact_pack(tenant), main.build_busy_reply(tenant), main.build_fallback_reply([], tenant)]
+    for text in replies + [tenant["welcome_message"]]:
+        assert "Nuxway" not in text and "nuxway" not in text
+        assert main.NUXWAY_PHONE_MOBILE not in text
+    assert main.contact_pack(tenant)
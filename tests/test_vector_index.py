@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from vector_index import VectorIndex, normalize, truncate, quantize, encode_b64
+
+SOURCE_DIMS = 64
+
+
+def _vectors(n, dims=SOURCE_DIMS, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, dims)).astype(np.float32)
+
+
+def test_truncate_renormalizes():
+    m = truncate(_vectors(5), 16)
+    assert m.shape == (5, 16)
+    np.testing.assert_allclose(np.linalg.norm(m, axis=1), 1.0, atol=1e-6)
+    # dims 0 o >= actual: solo normaliza
+    assert truncate(_vectors(5), 0).shape == (5, SOURCE_DIMS)
+    assert truncate(_vectors(5), 999).shape == (5, SOURCE_DIMS)
+
+
+def test_int8_scales_keep_each_row_in_range():
+    m = normalize(_vectors(20))
+    m[3] = 0.0  # vector nulo: escala 1, sin división por cero
+    data, scales = quantize(m, "int8")
+    assert data.dtype == np.int8 and scales.shape == (20,)
+    assert np.abs(data).max() == 127
+    np.testing.assert_allclose(data * scales[:, None], m, atol=scales.max())
+    assert scales[3] == 1.0 and not data[3].any()
+
+
+@pytest.mark.parametrize("fmt, tol", [("float32", 1e-6), ("float16", 2e-3), ("int8", 2e-2)])
+def test_scores_match_exact_float32(fmt, tol):
+    vectors = _vectors(200)
+    query = _vectors(1, seed=1)[0]
+    exact = normalize(vectors) @ normalize(query)
+
+    index = VectorIndex.from_vectors(vectors, fmt=fmt)
+    results = index.search(query, top_k=len(vectors))
+
+    assert len(results) == len(vectors)
+    for score, idx in results:
+        assert abs(score - exact[idx]) < tol
+    assert results[0][1] == int(np.argmax(exact))
+
+
+def _compact_store(tmp_path, vectors, missing, fmt="int8", dims=16):
+    """Store como lo escribe ingest.py, con docs sin embedding en `missing`."""
+    data, scales = quantize(truncate(vectors, dims), fmt)
+    docs = []
+    for i in range(len(vectors)):
+        d = {"source": f"doc{i}", "text": f"texto {i}"}
+        if i not in missing:
+            d["embedding_b64"] = encode_b64(data[i])
+            if scales is not None:
+                d["embedding_scale"] = float(scales[i])
+        docs.append(d)
+    np.save(tmp_path / "store.f32.npy", truncate(vectors, 0))
+    meta = {"format": fmt, "dims": dims, "source_dims": vectors.shape[1], "full_precision_file": "store.f32.npy"}
+    return {"embedding": meta, "docs": docs}, str(tmp_path / "store.json")
+
+
+def test_from_store_maps_rows_to_docs_with_gaps(tmp_path):
+    vectors = _vectors(6)
+    missing = {1, 4}
+    data, path = _compact_store(tmp_path, vectors, missing)
+
+    index = VectorIndex.from_store(data, path)
+
+    assert len(index) == 4 and index.dims == 16
+    assert index.rows.tolist() == [0, 2, 3, 5]
+    assert isinstance(index.full, np.memmap)
+    for doc_idx in (0, 2, 3, 5):
+        top_score, top_idx = index.search(vectors[doc_idx], top_k=1, rerank_candidates=4)[0]
+        assert top_idx == doc_idx
+        assert top_score == pytest.approx(1.0, abs=1e-5)
+    assert {i for _, i in index.search(vectors[0], top_k=10)} == {0, 2, 3, 5}
+
+
+def test_rerank_uses_full_precision_scores(tmp_path):
+    vectors = _vectors(6)
+    data, path = _compact_store(tmp_path, vectors, missing={1})
+    index = VectorIndex.from_store(data, path)
+    query = _vectors(1, seed=2)[0]
+    exact = normalize(vectors) @ normalize(query)
+
+    for score, idx in index.search(query, top_k=3, rerank_candidates=5):
+        assert score == pytest.approx(float(exact[idx]), abs=1e-5)
+
+
+def test_rerank_skipped_when_query_dims_do_not_match_full(tmp_path):
+    vectors = _vectors(6)
+    data, path = _compact_store(tmp_path, vectors, missing={1})
+    with_full = VectorIndex.from_store(data, path)
+    without_full = VectorIndex(with_full.data, with_full.scales, rows=with_full.rows, fmt=with_full.format)
+
+    query = truncate(vectors[2], 16)  # consulta ya truncada: no hay con qué re-puntuar
+
+    assert query.shape[-1] != with_full.full.shape[1]
+    assert with_full.search(query, top_k=3, rerank_candidates=5) == without_full.search(query, top_k=3)
+
+
+def test_legacy_store_with_gaps_compacts_on_load():
+    vectors = _vectors(5)
+    docs = [{"text": str(i), "embedding": v.tolist()} for i, v in enumerate(vectors)]
+    del docs[2]["embedding"]
+
+    index = VectorIndex.from_store({"docs": docs}, "unused.json", fmt="float16", dims=32)
+
+    assert index.format == "float16" and index.dims == 32
+    assert index.rows.tolist() == [0, 1, 3, 4]
+    assert index.search(vectors[3], top_k=1)[0][1] == 3
@@ -0,0 +1,169 @@
+import os
+import sys
+import time
+import threading
+import contextvars
+from collections import deque, Counter
+from contextlib import contextmanager
+
+import metrics
+
+# -------------------------
+# Tracing liviano por mensaje
+# -------------------------
+# Un trace por mensaje de WhatsApp (id = wamid). Cada span también alimenta
+# wpp_stage_duration_seconds, así una etapa se instrumenta en un solo lugar.
+# Los últimos TRACE_BUFFER_SIZE traces quedan en memoria para /debug/traces.
+
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+
+TRACES = deque(maxlen=TRACE_BUFFER_SIZE)
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def start_trace(trace_id: str, **attrs) -> dict:
+    trace = {
+        "trace_id": trace_id,
+        "start_ts": time.time(),
+        "_t0": time.perf_counter(),
+        "duration_ms": None,
+        "attrs": dict(attrs),
+        "spans": [],
+    }
+    _current_trace.set(trace)
+    _current_span.set(None)
+    return trace
+
+def annotate(**attrs):
+    """Agrega atributos al trace en curso (p.ej. intent)."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace["attrs"].update(attrs)
+
+def finish_trace():
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    trace["duration_ms"] = round((time.perf_counter() - trace.pop("_t0")) * 1000, 2)
+    TRACES.append(trace)
+    _current_trace.set(None)
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    with span("embed_query"):
+        ...
+    Mide la etapa aunque no haya trace activo (solo histograma en ese caso).
+    """
+    trace = _current_trace.get()
+    t0 = time.perf_counter()
+    if trace is None:
+        try:
+            yield
+        finally:
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - t0, stage=name)
+        return
+
+    rec = {
+        "name": name,
+        "parent": _current_span.get(),
+        "offset_ms": round((t0 - trace["_t0"]) * 1000, 2),
+        "duration_ms": None,
+    }
+    if attrs:
+        rec["attrs"] = attrs
+    trace["spans"].append(rec)
+    token = _current_span.set(len(trace["spans"]) - 1)
+    try:
+        yield
+    except BaseException as e:
+        rec["error"] = type(e).__name__
+        raise
+    finally:
+        dt = time.perf_counter() - t0
+        rec["duration_ms"] = round(dt * 1000, 2)
+        _current_span.reset(token)
+        metrics.STAGE_SECONDS.observe(dt, stage=name)
+
+def recent_traces(limit: int = 50):
+    out = list(TRACES)[-limit:]
+    out.reverse()
+    return out
+
+
+# -------------------------
+# Profiler por muestreo (opt-in, sin reiniciar el worker)
+# -------------------------
+# Un thread toma sys._current_frames() del thread del event loop cada
+# interval_ms durante una ventana y acumula stacks en formato "folded"
+# (func;func;func N), que consumen flamegraph.pl / speedscope / inferno.
+
+class SamplingProfiler:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.finished_at = None
+        self.interval_ms = None
+        self.window_s = None
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, window_s: float, interval_ms: float, target_thread_id: int) -> bool:
+        with self.lock:
+            if self.running:
+                return False
+            self.stacks = Counter()
+            self.samples = 0
+            self.started_at = time.time()
+            self.finished_at = None
+            self.interval_ms = interval_ms
+            self.window_s = window_s
+            self.thread = threading.Thread(
+                target=self._run, args=(window_s, interval_ms / 1000.0, target_thread_id),
+                name="sampling-profiler", daemon=True,
+            )
+            self.thread.start()
+            return True
+
+    def _run(self, window_s: float, interval_s: float, target_thread_id: int):
+        deadline = time.perf_counter() + window_s
+        while time.perf_counter() < deadline:
+            frame = sys._current_frames().get(target_thread_id)
+            if frame is not None:
+                self.stacks[self._fold(frame)] += 1
+                self.samples += 1
+            time.sleep(interval_s)
+        self.finished_at = time.time()
+
+    @staticmethod
+    def _fold(frame) -> str:
+        parts = []
+        while frame is not None:
+            code = frame.f_code
+            parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        parts.reverse()
+        return ";".join(parts)
+
+    def status(self) -> dict:
+        return {
+            "running": self.running,
+            "samples": self.samples,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "interval_ms": self.interval_ms,
+            "window_s": self.window_s,
+        }
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {n}" for stack, n in self.stacks.most_common()) + "\n"
+
+
+PROFILER = SamplingProfiler()
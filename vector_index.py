@@ -0,0 +1,163 @@
+import os
+import base64
+import numpy as np
+
+# -------------------------
+# Índice de embeddings compacto (float32 / float16 / int8 + dims truncadas)
+# -------------------------
+# Formato en knowledge_store.json:
+#   legado:   doc["embedding"] = [float, ...]  (float32, dims completas)
+#   compacto: data["embedding"] = {"format": "int8", "dims": 512, "source_dims": 1536,
+#                                  "full_precision_file": "knowledge_store.f32.npy"}
+#             doc["embedding_b64"] = base64(bytes del vector cuantizado)
+#             doc["embedding_scale"] = float   (solo int8)
+#
+# text-embedding-3-* admite acortar: truncar a N dims y renormalizar equivale
+# al parámetro `dimensions` de la API, así que la consulta se pide completa
+# y se trunca localmente (la versión completa se usa para el rerank).
+
+FORMATS = ("float32", "float16", "int8")
+_DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+SEARCH_BLOCK_ROWS = 4096
+
+
+def normalize(m: np.ndarray) -> np.ndarray:
+    m = np.asarray(m, dtype=np.float32)
+    norms = np.linalg.norm(m, axis=-1, keepdims=True) + 1e-12
+    return m / norms
+
+def truncate(m: np.ndarray, dims: int) -> np.ndarray:
+    """Trunca a `dims` y renormaliza (dims <= 0 o >= actual: solo normaliza)."""
+    m = np.asarray(m, dtype=np.float32)
+    if dims and 0 < dims < m.shape[-1]:
+        m = m[..., :dims]
+    return normalize(m)
+
+def quantize(m: np.ndarray, fmt: str):
+    """(data, scales). int8: escala por vector = max|x| / 127."""
+    if fmt not in FORMATS:
+        raise ValueError(f"formato de embedding no soportado: {fmt}")
+    m = np.asarray(m, dtype=np.float32)
+    if fmt == "int8":
+        scales = np.abs(m).max(axis=-1) / 127.0
+        scales[scales == 0] = 1.0
+        data = np.clip(np.rint(m / scales[..., None]), -127, 127).astype(np.int8)
+        return data, scales.astype(np.float32)
+    return m.astype(_DTYPES[fmt]), None
+
+def encode_b64(vec: np.ndarray) -> str:
+    return base64.b64encode(np.ascontiguousarray(vec).tobytes()).decode("ascii")
+
+def decode_b64(s: str, fmt: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(s), dtype=_DTYPES[fmt])
+
+
+class VectorIndex:
+    def __init__(self, data: np.ndarray, scales=None, rows=None, full=None, fmt: str = "float32"):
+        self.data = data            # (N, dims) float32|float16|int8, filas normalizadas
+        self.scales = scales        # (N,) float32 para int8
+        self.rows = rows if rows is not None else np.arange(len(data))  # fila -> índice de doc
+        self.full = full            # (N_docs, source_dims) float32 normalizado (memmap) o None
+        self.format = fmt
+
+    @property
+    def dims(self) -> int:
+        return int(self.data.shape[1]) if self.data.ndim == 2 and len(self.data) else 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def nbytes(self) -> int:
+        """Memoria residente del índice (el memmap full no cuenta: lo pagina el SO)."""
+        n = self.data.nbytes + self.rows.nbytes
+        if self.scales is not None:
+            n += self.scales.nbytes
+        return n
+
+    def _coarse_scores(self, q: np.ndarray) -> np.ndarray:
+        out = np.empty(len(self.data), dtype=np.float32)
+        for i in range(0, len(self.data), SEARCH_BLOCK_ROWS):
+            block = self.data[i:i + SEARCH_BLOCK_ROWS].astype(np.float32, copy=False)
+            out[i:i + SEARCH_BLOCK_ROWS] = block @ q
+        if self.scales is not None:
+            out *= self.scales
+        return out
+
+    def search(self, query, top_k: int = 6, rerank_candidates: int = 0):
+        """
+        [(score, doc_idx), ...] ordenado desc.
+        Con rerank_candidates > top_k y vectores full disponibles, los mejores
+        candidatos se re-puntúan con el embedding completo en float32.
+        """
+        if not len(self.data):
+            return []
+        q_full = np.asarray(query, dtype=np.float32)
+        q = truncate(q_full, self.dims)
+        scores = self._coarse_scores(q)
+
+        k = min(len(scores), max(top_k, rerank_candidates if self.full is not None else 0))
+        cand = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+
+        if self.full is not None and rerank_candidates > top_k and q_full.shape[-1] == self.full.shape[1]:
+            doc_idx = self.rows[cand]
+            order = np.argsort(doc_idx)  # lectura ordenada del memmap
+            full_rows = np.asarray(self.full[doc_idx[order]], dtype=np.float32)
+            rescored = np.empty(len(cand), dtype=np.float32)
+            rescored[order] = full_rows @ normalize(q_full)
+            scores_c = rescored
+        else:
+            scores_c = scores[cand]
+
+        top = np.argsort(-scores_c)[:top_k]
+        return [(float(scores_c[i]), int(self.rows[cand[i]])) for i in top]
+
+    @classmethod
+    def from_vectors(cls, vectors: np.ndarray, fmt: str = "float32", dims: int = 0, full=None):
+        """Construye desde vectores float (p.ej. store legado) cuantizando en memoria."""
+        m = truncate(vectors, dims)
+        data, scales = quantize(m, fmt)
+        return cls(data, scales, full=full, fmt=fmt)
+
+    @classmethod
+    def from_store(cls, data: dict, store_path: str, fmt: str = "", dims: int = 0):
+        """
+        Lee el índice desde el JSON del store. Para stores legados (listas float)
+        `fmt`/`dims` permiten compactar al cargar sin re-ingestar.
+        """
+        docs = data.get("docs", [])
+        meta = data.get("embedding") or {}
+        full = None
+        full_file = meta.get("full_precision_file")
+        if full_file:
+            full_path = os.path.join(os.path.dirname(os.path.abspath(store_path)), full_file)
+            if os.path.exists(full_path):
+                full = np.load(full_path, mmap_mode="r")
+
+        if meta.get("format"):
+            store_fmt = meta["format"]
+            rows, vecs, scales = [], [], []
+            for i, d in enumerate(docs):
+                b64 = d.get("embedding_b64")
+                if not b64:
+                    continue
+                rows.append(i)
+                vecs.append(decode_b64(b64, store_fmt))
+                if store_fmt == "int8":
+                    scales.append(d.get("embedding_scale", 1.0))
+            if not rows:
+                return cls(np.zeros((0, 0), dtype=np.float32), fmt=store_fmt, full=full)
+            return cls(
+                np.stack(vecs),
+                np.asarray(scales, dtype=np.float32) if store_fmt == "int8" else None,
+                rows=np.asarray(rows, dtype=np.int64),
+                full=full,
+                fmt=store_fmt,
+            )
+
+        rows = [i for i, d in enumerate(docs) if d.get("embedding")]
+        if not rows:
+            return cls(np.zeros((0, 0), dtype=np.float32), full=full)
+        vectors = np.asarray([docs[i]["embedding"] for i in rows], dtype=np.float32)
+        index = cls.from_vectors(vectors, fmt or "float32", dims, full=full)
+        index.rows = np.asarray(rows, dtype=np.int64)
+        return index